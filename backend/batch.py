@@ -0,0 +1,229 @@
+"""
+Batch debrief mode: summary feedback for a cohort of recorded sessions.
+
+Each input line is a JSON object such as
+    {"session_id": "learner-07", "caseBookletLink": "septic_shock.txt",
+     "transcript": [{"role": "assistant", "content": "..."}, {"role": "user", "content": "..."}]}
+Sessions run with bounded concurrency and results are emitted as JSONL in
+completion order. Completed session ids are appended to a checkpoint file,
+so rerunning an interrupted batch skips them.
+
+Usage (from the backend directory):
+    python batch.py cohort.jsonl --output results.jsonl --concurrency 8
+    cat cohort.jsonl | python batch.py - > results.jsonl
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from typing import AsyncIterator, Dict, Iterable, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint:
+    """Append-only file of completed session ids."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.completed = set()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.completed = {line.strip() for line in f if line.strip()}
+        self._file = open(path, "a", encoding="utf-8")
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self.completed
+
+    def mark(self, session_id: str):
+        self.completed.add(session_id)
+        self._file.write(session_id + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class RateLimiter:
+    """Spaces request starts evenly so a batch stays under a requests-per-minute budget."""
+
+    def __init__(self, requests_per_minute: float):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+async def _aiter(sessions: Union[Iterable, AsyncIterator]) -> AsyncIterator:
+    if hasattr(sessions, "__aiter__"):
+        async for item in sessions:
+            yield item
+    else:
+        for item in sessions:
+            yield item
+
+
+async def parse_jsonl(lines: Union[Iterable[str], AsyncIterator[str]]) -> AsyncIterator[Dict]:
+    """Decode JSONL, giving every record a session_id; malformed lines become records with an `error`."""
+    line_number = 0
+    async for line in _aiter(lines):
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("expected a JSON object")
+        except ValueError as e:
+            record = {"error": f"invalid JSON: {e}"}
+        record.setdefault("session_id", f"line-{line_number}")
+        yield record
+
+
+async def _process(model, record: Dict) -> Dict:
+    session_id = str(record["session_id"])
+    if "error" in record:
+        return {"session_id": session_id, "status": "error", "error": record["error"]}
+    transcript = record.get("transcript")
+    if not isinstance(transcript, list) or not transcript:
+        return {"session_id": session_id, "status": "error", "error": "transcript must be a non-empty list"}
+    start = time.perf_counter()
+    try:
+        summary, stats = await model.asummarize_transcript(transcript, record.get("caseBookletLink"))
+    except Exception as e:
+        return {"session_id": session_id, "status": "error", "error": str(e)}
+    return {
+        "session_id": session_id,
+        "status": "ok",
+        "summary": summary,
+        "prompt_tokens": stats.tokens_out,
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 1)
+    }
+
+
+async def run_batch(model, sessions: Union[Iterable[Dict], AsyncIterator[Dict]], concurrency: int = 8,
+                    checkpoint: Optional[Checkpoint] = None, rate_limiter: Optional[RateLimiter] = None) -> AsyncIterator[Dict]:
+    """
+    Yield one result per session as soon as it finishes. At most
+    `concurrency` sessions are in flight and at most twice that many are
+    buffered from the input, so arbitrarily large streams are fine. A
+    session is checkpointed only after the caller has consumed its result.
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+    pending: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    results: asyncio.Queue = asyncio.Queue()
+
+    async def produce():
+        async for record in _aiter(sessions):
+            if checkpoint is not None and str(record["session_id"]) in checkpoint:
+                continue
+            await pending.put(record)
+        for _ in range(concurrency):
+            await pending.put(None)
+
+    async def work():
+        while True:
+            record = await pending.get()
+            if record is None:
+                return
+            if rate_limiter is not None:
+                await rate_limiter.acquire()
+            await results.put(await _process(model, record))
+
+    async def run_all():
+        try:
+            await asyncio.gather(produce(), *(work() for _ in range(concurrency)))
+        finally:
+            await results.put(None)
+
+    runner = asyncio.ensure_future(run_all())
+    try:
+        while True:
+            result = await results.get()
+            if result is None:
+                break
+            yield result
+            if checkpoint is not None and result["status"] == "ok":
+                checkpoint.mark(result["session_id"])
+        await runner
+    finally:
+        runner.cancel()
+
+
+async def _read_lines(stream) -> AsyncIterator[str]:
+    # readline runs in a thread so a slow stdin producer does not stall in-flight sessions
+    while True:
+        line = await asyncio.to_thread(stream.readline)
+        if not line:
+            return
+        yield line
+
+
+async def main_async(args) -> int:
+    from pearls_model import PEARLSModel
+
+    model = PEARLSModel()
+    input_stream = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    checkpoint_path = args.checkpoint or (f"{args.output}.checkpoint" if args.output else None)
+    checkpoint = Checkpoint(checkpoint_path) if checkpoint_path else None
+    if checkpoint is not None and checkpoint.completed:
+        logger.info("Resuming batch: %d sessions already completed", len(checkpoint.completed))
+    if args.output:
+        output = open(args.output, "a" if checkpoint is not None and checkpoint.completed else "w", encoding="utf-8")
+    else:
+        output = sys.stdout
+
+    ok = failed = 0
+    start = time.perf_counter()
+    try:
+        async for result in run_batch(model, parse_jsonl(_read_lines(input_stream)), args.concurrency, checkpoint,
+                                      RateLimiter(args.requests_per_minute)):
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+            if result["status"] == "ok":
+                ok += 1
+            else:
+                failed += 1
+    finally:
+        await model.aclose()
+        if checkpoint is not None:
+            checkpoint.close()
+        if input_stream is not sys.stdin:
+            input_stream.close()
+        if output is not sys.stdout:
+            output.close()
+    logger.info("Batch finished: %d ok, %d failed in %.1f s", ok, failed, time.perf_counter() - start)
+    return 0 if failed == 0 else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL file of sessions, or - for stdin")
+    parser.add_argument("--output", help="JSONL results file (default: stdout)")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("BATCH_CONCURRENCY", "8")))
+    parser.add_argument("--requests-per-minute", type=float, default=float(os.getenv("BATCH_REQUESTS_PER_MINUTE", "0")),
+                        help="upper bound on upstream request rate (0 = unlimited)")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: <output>.checkpoint)")
+    args = parser.parse_args()
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if args.requests_per_minute < 0:
+        parser.error("--requests-per-minute must not be negative")
+    sys.exit(asyncio.run(main_async(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Batch debrief benchmark: wall-clock time for a cohort at several concurrency limits.
+
+Builds a cohort from the scripted sessions in benchmarks/scenarios and runs
+it through batch.run_batch against the mock upstream. With a fixed upstream
+latency, wall time should fall roughly as sessions / concurrency.
+
+Usage (from the backend directory):
+    python -m benchmarks.batch_bench --sessions 50 --concurrency 1 5 10 25 50
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+
+from benchmarks.mock_together import MockServer, create_mock_app
+from benchmarks.run_bench import SCENARIOS_PATH, percentile
+
+
+def build_cohort(sessions: int) -> list:
+    with open(SCENARIOS_PATH, encoding="utf-8") as f:
+        scripts = json.load(f)
+    return [
+        {"session_id": f"learner-{i:03d}", "transcript": scripts[i % len(scripts)]["turns"]}
+        for i in range(sessions)
+    ]
+
+
+async def run(args):
+    cohort = build_cohort(args.sessions)
+    mock_app = create_mock_app(latency=args.latency, token_delay=args.token_delay, latency_sigma=0.3, seed=args.seed)
+    with MockServer(mock_app) as upstream:
+        os.environ["TOGETHERAI_BASE_URL"] = upstream.base_url
+        from batch import run_batch
+        from pearls_model import PEARLSModel
+
+        logging.getLogger().setLevel(logging.WARNING)
+        model = PEARLSModel()
+        results = []
+        for concurrency in args.concurrency:
+            latencies = []
+            failures = 0
+            start = time.perf_counter()
+            async for result in run_batch(model, cohort, concurrency):
+                if result["status"] == "ok":
+                    latencies.append(result["elapsed_ms"])
+                else:
+                    failures += 1
+            elapsed = time.perf_counter() - start
+            level = {
+                "concurrency": concurrency,
+                "sessions": len(cohort),
+                "wall_s": round(elapsed, 2),
+                "sessions_per_s": round(len(cohort) / elapsed, 2),
+                "p50_ms": round(percentile(latencies, 50), 1),
+                "p99_ms": round(percentile(latencies, 99), 1),
+                "failures": failures,
+            }
+            results.append(level)
+            print(json.dumps(level))
+        await model.aclose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 5, 10, 25, 50])
+    parser.add_argument("--latency", type=float, default=0.3, help="median upstream time to first token (s)")
+    parser.add_argument("--token-delay", type=float, default=0.005, help="median delay per completion token (s)")
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+    os.environ.setdefault("TOGETHERAI_API_KEY", "mock-key")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
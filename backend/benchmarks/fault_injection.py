@@ -0,0 +1,254 @@
+"""
+Tail-latency benchmark for the upstream router against a fault-injecting mock.
+
+Sends the same sequence of completions through three router configurations:
+a single attempt, deadline-aware retries, and retries with hedging. Reports
+success rate, p50/p99 latency and how many upstream calls each one made.
+
+With --check it instead runs assertion-based checks of the router against
+scripted faults: the circuit breaker opening, half-opening and closing
+(including after a non-retryable error or a cancelled trial), 429s not
+counting toward the breaker, retries waiting for Retry-After, and hedging
+past a stalled attempt, and calls queued for a concurrency slot not timing
+out or opening the breaker. It exits non-zero if any check fails.
+
+Usage (from the backend directory):
+    python -m benchmarks.fault_injection --failure-rate 0.1 --stall-rate 0.05 --requests 200
+    python -m benchmarks.fault_injection --check
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+import httpx
+
+import metrics
+from benchmarks.mock_together import MockServer, create_mock_app
+from benchmarks.run_bench import percentile
+from llm_client import AsyncLLMClient, LLMClientConfig
+from upstream_router import CircuitOpenError, UpstreamRouter
+
+PAYLOAD = {
+    "model": "mock-model",
+    "messages": [{"role": "user", "content": "How did the resuscitation go?"}],
+    "max_tokens": 50
+}
+
+
+async def run_config(name: str, base_url: str, requests: int, concurrency: int, deadline: float, attempt_timeout: float,
+                     **router_options) -> dict:
+    client = AsyncLLMClient("mock-key", LLMClientConfig(base_url=base_url, read_timeout=deadline))
+    router = UpstreamRouter(client, deadline=deadline, attempt_timeout=attempt_timeout, breaker_threshold=10 ** 6, **router_options)
+    latencies = []
+    failures = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await router.chat_completion(PAYLOAD)
+                latencies.append(time.perf_counter() - start)
+            except Exception:
+                failures += 1
+
+    await asyncio.gather(*(one() for _ in range(requests)))
+    await client.aclose()
+    return {
+        "config": name,
+        "success_rate": round(len(latencies) / requests, 4),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "failures": failures,
+    }
+
+
+async def run(args):
+    logging.getLogger().setLevel(logging.CRITICAL)
+    configs = [
+        ("single_attempt", {"max_attempts": 1, "hedge": False}),
+        ("retries", {"max_attempts": 3, "hedge": False}),
+        ("retries_hedged", {"max_attempts": 3, "hedge": True}),
+    ]
+    results = []
+    for name, options in configs:
+        mock_app = create_mock_app(
+            latency=args.latency, token_delay=0.0, latency_sigma=0.3, seed=args.seed,
+            failure_rate=args.failure_rate, stall_rate=args.stall_rate, stall_seconds=args.stall_seconds
+        )
+        with MockServer(mock_app) as upstream:
+            result = await run_config(name, upstream.base_url, args.requests, args.concurrency, args.deadline,
+                                      args.attempt_timeout, **options)
+        result["upstream_requests"] = mock_app.state.requests
+        results.append(result)
+        print(json.dumps(result))
+    return results
+
+
+async def _expect_status(router: UpstreamRouter, status: int):
+    try:
+        await router.chat_completion(PAYLOAD)
+    except httpx.HTTPStatusError as e:
+        assert e.response.status_code == status, f"expected {status}, got {e.response.status_code}"
+        return
+    raise AssertionError(f"expected HTTP {status}, call succeeded")
+
+
+async def _expect_circuit_open(router: UpstreamRouter):
+    try:
+        await router.chat_completion(PAYLOAD)
+    except CircuitOpenError:
+        return
+    raise AssertionError("expected CircuitOpenError")
+
+
+async def _drain_stream(router: UpstreamRouter) -> str:
+    return "".join([token async for token in router.stream_chat_completion(PAYLOAD)])
+
+
+async def check_breaker_cycle(mock_app, client: AsyncLLMClient):
+    router = UpstreamRouter(client, max_attempts=1, breaker_threshold=2, breaker_reset_after=0.2)
+    breaker = router.breaker(PAYLOAD["model"])
+    mock_app.state.scripted.extend([{"status": 503}, {"status": 503}])
+    await _expect_status(router, 503)
+    assert breaker.state == "closed"
+    await _expect_status(router, 503)
+    assert breaker.state == "open"
+    requests_before = mock_app.state.requests
+    await _expect_circuit_open(router)
+    assert mock_app.state.requests == requests_before, "an open breaker must not call upstream"
+
+    await asyncio.sleep(0.25)
+    assert breaker.state == "half_open"
+    mock_app.state.scripted.append({"status": 503})
+    await _expect_status(router, 503)
+    assert breaker.state == "open", "a failed trial reopens the breaker"
+
+    await asyncio.sleep(0.25)
+    await router.chat_completion(PAYLOAD)
+    assert breaker.state == "closed", "a successful trial closes the breaker"
+
+
+async def check_trial_not_wedged(mock_app, client: AsyncLLMClient):
+    router = UpstreamRouter(client, max_attempts=1, breaker_threshold=2, breaker_reset_after=0.2)
+    breaker = router.breaker(PAYLOAD["model"])
+
+    # A non-retryable error on the trial shows upstream is reachable
+    mock_app.state.scripted.extend([{"status": 503}, {"status": 503}, {"status": 400}])
+    await _expect_status(router, 503)
+    await _expect_status(router, 503)
+    await asyncio.sleep(0.25)
+    await _expect_status(router, 400)
+    assert breaker.state == "closed", f"breaker is {breaker.state} after a 400 on the trial"
+    await router.chat_completion(PAYLOAD)
+
+    # A cancelled trial, buffered or streamed, lets the next call try again
+    for consume in (lambda: router.chat_completion(PAYLOAD), lambda: _drain_stream(router)):
+        mock_app.state.scripted.extend([{"status": 503}, {"status": 503}, {"delay": 5}])
+        await _expect_status(router, 503)
+        await _expect_status(router, 503)
+        await asyncio.sleep(0.25)
+        trial = asyncio.ensure_future(consume())
+        await asyncio.sleep(0.1)
+        trial.cancel()
+        await asyncio.gather(trial, return_exceptions=True)
+        assert breaker.state == "half_open", f"breaker is {breaker.state} after a cancelled trial"
+        await consume()
+        assert breaker.state == "closed"
+
+
+async def check_rate_limit_backoff(mock_app, client: AsyncLLMClient):
+    router = UpstreamRouter(client, max_attempts=1, breaker_threshold=2, breaker_reset_after=0.2)
+    mock_app.state.scripted.extend([{"status": 429}] * 3)
+    for _ in range(3):
+        await _expect_status(router, 429)
+    assert router.breaker(PAYLOAD["model"]).state == "closed", "429s must not open the breaker"
+
+    router = UpstreamRouter(client, max_attempts=2, backoff_base=0.01, backoff_cap=0.01)
+    mock_app.state.scripted.append({"status": 429, "headers": {"Retry-After": "1"}})
+    requests_before = mock_app.state.requests
+    start = time.perf_counter()
+    await router.chat_completion(PAYLOAD)
+    elapsed = time.perf_counter() - start
+    assert elapsed >= 1.0, f"retried after {elapsed:.2f}s, before Retry-After"
+    assert mock_app.state.requests - requests_before == 2
+
+
+async def check_hedging(mock_app, client: AsyncLLMClient):
+    router = UpstreamRouter(client, max_attempts=1, hedge=True)
+    for _ in range(router.hedge_min_samples):
+        await router.chat_completion(PAYLOAD)
+    hedges_before = metrics.upstream_hedges.value(model=PAYLOAD["model"])
+    mock_app.state.scripted.append({"delay": 5})
+    start = time.perf_counter()
+    await router.chat_completion(PAYLOAD)
+    elapsed = time.perf_counter() - start
+    assert elapsed < 1.0, f"hedged call took {elapsed:.2f}s"
+    assert metrics.upstream_hedges.value(model=PAYLOAD["model"]) == hedges_before + 1
+    breaker = router.breaker(PAYLOAD["model"])
+    assert breaker.state == "closed" and breaker.failures == 0, "a cancelled hedge loser is not a failure"
+
+
+async def check_queue_not_outage(mock_app, client: AsyncLLMClient):
+    # Twelve calls through two slots queue for longer than the attempt timeout
+    queued = AsyncLLMClient("mock-key", LLMClientConfig(base_url=client.config.base_url, max_concurrency=2))
+    try:
+        router = UpstreamRouter(queued, max_attempts=1, attempt_timeout=0.5, breaker_threshold=2)
+        mock_app.state.scripted.extend([{"delay": 0.2}] * 12)
+        results = await asyncio.gather(*(router.chat_completion(PAYLOAD) for _ in range(12)), return_exceptions=True)
+        errors = [type(result).__name__ for result in results if isinstance(result, BaseException)]
+        assert not errors, f"calls failed while queued for a slot: {errors}"
+        assert router.breaker(PAYLOAD["model"]).state == "closed", "queueing for a slot must not open the breaker"
+        slowest = max(router._latencies[PAYLOAD["model"]])
+        assert slowest < 0.5, f"latency sample of {slowest:.2f}s includes time queued for a slot"
+    finally:
+        await queued.aclose()
+
+
+CHECKS = [check_breaker_cycle, check_trial_not_wedged, check_rate_limit_backoff, check_hedging, check_queue_not_outage]
+
+
+async def run_checks() -> bool:
+    logging.getLogger().setLevel(logging.CRITICAL)
+    passed = True
+    for check in CHECKS:
+        mock_app = create_mock_app(latency=0.02, token_delay=0.0)
+        with MockServer(mock_app) as upstream:
+            client = AsyncLLMClient("mock-key", LLMClientConfig(base_url=upstream.base_url))
+            try:
+                await check(mock_app, client)
+                print(f"PASS {check.__name__}")
+            except Exception as e:
+                passed = False
+                print(f"FAIL {check.__name__}: {type(e).__name__}: {e}")
+            finally:
+                await client.aclose()
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--failure-rate", type=float, default=0.1)
+    parser.add_argument("--stall-rate", type=float, default=0.05)
+    parser.add_argument("--stall-seconds", type=float, default=5.0)
+    parser.add_argument("--deadline", type=float, default=3.0)
+    parser.add_argument("--attempt-timeout", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--check", action="store_true", help="run the assertion-based router checks instead")
+    args = parser.parse_args()
+    os.environ.setdefault("TOGETHERAI_API_KEY", "mock-key")
+    if args.check:
+        sys.exit(0 if asyncio.run(run_checks()) else 1)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
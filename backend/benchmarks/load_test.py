@@ -0,0 +1,96 @@
+"""
+Load test for the upstream LLM client against a local mock completion server.
+
+Runs the same number of debrief turns per session at increasing session
+concurrency and reports throughput, once through aprocess_input and once
+through a blocking baseline that posts each turn with requests from the
+event loop, which is how /debrief called upstream before the async client.
+The response cache is disabled, since every session sends the same turns
+and would otherwise share upstream calls.
+
+Usage (from the backend directory):
+    python -m benchmarks.load_test --latency 0.2 --concurrency 1 5 10 30
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+import requests
+
+from benchmarks.mock_together import MockServer, create_mock_app
+
+
+def _blocking_completion(http: requests.Session, url: str, history: list) -> str:
+    payload = {
+        "model": "mistralai/Mixtral-8x7B-Instruct-v0.1",
+        "messages": [{"role": "system", "content": "You are a helpful assistant."}] + history,
+        "temperature": 0.7,
+        "max_tokens": 500
+    }
+    response = http.post(url, headers={"Authorization": "Bearer mock-key"}, json=payload, timeout=60)
+    response.raise_for_status()
+    return response.json()["choices"][0]["message"]["content"]
+
+
+async def _run_sessions(model, http: requests.Session, concurrency: int, turns: int, use_async: bool) -> float:
+    async def session():
+        history = []
+        for turn in range(turns):
+            text = f"Turn {turn}: I think the team handled the airway well."
+            history.append({"role": "user", "content": text})
+            if use_async:
+                reply = await model.aprocess_input(text, conversation_history=history)
+            else:
+                reply = _blocking_completion(http, model.llm_client.config.url, history)
+            history.append({"role": "assistant", "content": reply})
+
+    start = time.perf_counter()
+    await asyncio.gather(*(session() for _ in range(concurrency)))
+    return time.perf_counter() - start
+
+
+async def run(latencies, concurrency_levels, turns: int):
+    from pearls_model import PEARLSModel
+
+    logging.getLogger().setLevel(logging.WARNING)
+    results = []
+    for latency in latencies:
+        with MockServer(create_mock_app(latency)) as server:
+            os.environ["TOGETHERAI_BASE_URL"] = server.base_url
+            for concurrency in concurrency_levels:
+                for use_async in (False, True):
+                    model = PEARLSModel()
+                    with requests.Session() as http:
+                        elapsed = await _run_sessions(model, http, concurrency, turns, use_async)
+                    await model.aclose()
+                    requests_done = concurrency * turns
+                    results.append({
+                        "latency": latency,
+                        "concurrency": concurrency,
+                        "mode": "async" if use_async else "blocking",
+                        "requests": requests_done,
+                        "elapsed_s": round(elapsed, 3),
+                        "throughput_rps": round(requests_done / elapsed, 2)
+                    })
+                    print(
+                        f"latency={latency:.2f}s concurrency={concurrency:3d} "
+                        f"mode={results[-1]['mode']:8s} throughput={results[-1]['throughput_rps']:8.2f} req/s"
+                    )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, nargs="+", default=[0.2])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 5, 10, 30])
+    parser.add_argument("--turns", type=int, default=3)
+    args = parser.parse_args()
+    os.environ.setdefault("TOGETHERAI_API_KEY", "mock-key")
+    os.environ["RESPONSE_CACHE_ENABLED"] = "0"
+    asyncio.run(run(args.latency, args.concurrency, args.turns))
+
+
+if __name__ == "__main__":
+    main()
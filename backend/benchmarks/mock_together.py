@@ -0,0 +1,132 @@
+"""
+Local stand-in for the Together AI /v1/chat/completions endpoint.
+Each completion waits for a time-to-first-token drawn from a lognormal
+distribution around `latency`, then produces `completion_tokens` words with
+lognormal per-token delays around `token_delay`. That is enough to show
+whether the backend overlaps upstream waits or serializes them, and how
+it behaves under a realistic latency tail.
+Requests with `stream: true` get an SSE token stream; other requests get
+the whole completion once the last token would have been produced.
+For fault injection, `failure_rate` of requests answer 503 immediately
+and `stall_rate` of requests wait an extra `stall_seconds` first.
+Deterministic faults can be queued on `app.state.scripted`: each entry is
+a dict with an optional `delay` in seconds and an optional `status` (plus
+`headers`) to answer with instead of a completion, and is used by the
+next request.
+"""
+import asyncio
+import json
+import random
+import socket
+import threading
+import time
+from collections import deque
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, StreamingResponse
+import uvicorn
+
+
+MOCK_REPLY = "What stood out to you about how the case went?"
+
+
+def _sample(rng: random.Random, median: float, sigma: float) -> float:
+    return median * rng.lognormvariate(0, sigma) if sigma > 0 else median
+
+
+def create_mock_app(latency: float = 0.5, token_delay: float = 0.02, latency_sigma: float = 0.0,
+                    token_delay_sigma: float = 0.0, completion_tokens: int = None, seed: int = None,
+                    failure_rate: float = 0.0, stall_rate: float = 0.0, stall_seconds: float = 30.0) -> FastAPI:
+    mock_app = FastAPI()
+    mock_app.state.latency = latency
+    mock_app.state.token_delay = token_delay
+    mock_app.state.requests = 0
+    mock_app.state.failures = 0
+    mock_app.state.stalls = 0
+    mock_app.state.scripted = deque()
+    rng = random.Random(seed)
+    reply_words = MOCK_REPLY.split(" ")
+    if completion_tokens:
+        reply_words = (reply_words * (completion_tokens // len(reply_words) + 1))[:completion_tokens]
+
+    def sample_timing():
+        first_token = _sample(rng, mock_app.state.latency, latency_sigma)
+        if rng.random() < stall_rate:
+            mock_app.state.stalls += 1
+            first_token += stall_seconds
+        per_token = [_sample(rng, mock_app.state.token_delay, token_delay_sigma) for _ in reply_words]
+        return first_token, per_token
+
+    async def stream_reply(request_id: str):
+        first_token, per_token = sample_timing()
+        await asyncio.sleep(first_token)
+        for i, (word, delay) in enumerate(zip(reply_words, per_token)):
+            chunk = {
+                "id": request_id,
+                "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}]
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+            await asyncio.sleep(delay)
+        yield "data: [DONE]\n\n"
+
+    @mock_app.post("/v1/chat/completions")
+    async def chat_completions(payload: dict):
+        mock_app.state.requests += 1
+        request_id = f"mock-{mock_app.state.requests}"
+        if mock_app.state.scripted:
+            fault = mock_app.state.scripted.popleft()
+            await asyncio.sleep(fault.get("delay", 0))
+            if "status" in fault:
+                return JSONResponse({"error": {"message": "scripted fault"}}, status_code=fault["status"],
+                                    headers=fault.get("headers"))
+        if rng.random() < failure_rate:
+            mock_app.state.failures += 1
+            return JSONResponse({"error": {"message": "injected failure"}}, status_code=503)
+        if payload.get("stream"):
+            return StreamingResponse(stream_reply(request_id), media_type="text/event-stream")
+        first_token, per_token = sample_timing()
+        await asyncio.sleep(first_token + sum(per_token))
+        return {
+            "id": request_id,
+            "model": payload.get("model"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": " ".join(reply_words)},
+                    "finish_reason": "stop"
+                }
+            ],
+            "usage": {"prompt_tokens": 100, "completion_tokens": len(reply_words), "total_tokens": 100 + len(reply_words)}
+        }
+
+    return mock_app
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class MockServer:
+    """Runs an ASGI app with uvicorn on a background thread."""
+
+    def __init__(self, app: FastAPI, port: int = None):
+        self.app = app
+        self.port = port or _free_port()
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.should_exit = True
+        self.thread.join()
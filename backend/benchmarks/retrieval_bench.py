@@ -0,0 +1,80 @@
+"""
+Booklet retrieval benchmark over the local fixtures in benchmarks/fixtures.
+
+Reports index build time (cold and from the on-disk cache) and per-query
+search latency. Each fixture is also repeated --scale times to approximate
+a long booklet.
+
+Usage (from the backend directory):
+    python -m benchmarks.retrieval_bench --scale 1 20
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from booklet_index import BookletRegistry
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+QUERIES = [
+    "We struggled to get IV access and took too long to place the IO",
+    "I wasn't sure when to start epinephrine",
+    "The parents kept asking questions and nobody talked to them",
+    "did we give the antibiotics in time",
+    "I think the fluid boluses went fine",
+    "The team leader got stuck doing a task",
+    "yes",
+]
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 3)
+
+
+def bench_fixture(name: str, text: str, scale: int, rounds: int) -> dict:
+    text = "\n".join(f"Section {i}. {text}" for i in range(scale))
+    with tempfile.TemporaryDirectory() as cache_dir:
+        registry = BookletRegistry(cache_dir=cache_dir)
+        start = time.perf_counter()
+        index = registry._load_or_build(text)
+        build_s = time.perf_counter() - start
+        start = time.perf_counter()
+        registry._load_or_build(text)
+        cached_s = time.perf_counter() - start
+
+    timings = []
+    for _ in range(rounds):
+        for query in QUERIES:
+            start = time.perf_counter()
+            index.search(query, registry.top_k)
+            timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        "fixture": name,
+        "scale": scale,
+        "chunks": len(index.chunks),
+        "vocab": len(index.vocab),
+        "build_ms": _ms(build_s),
+        "cached_load_ms": _ms(cached_s),
+        "search_p50_ms": _ms(statistics.median(timings)),
+        "search_p99_ms": _ms(timings[int(len(timings) * 0.99) - 1]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=int, nargs="+", default=[1, 20])
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+    for name in sorted(os.listdir(FIXTURES_DIR)):
+        with open(os.path.join(FIXTURES_DIR, name), encoding="utf-8") as f:
+            text = f.read()
+        for scale in args.scale:
+            print(json.dumps(bench_fixture(name, text, scale, args.rounds)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""
+Reproducible load and latency benchmark for the debrief backend.
+
+Starts a mock Together AI server with configurable latency and token-rate
+distributions, then starts the FastAPI `app` from main.py against it in a
+child process, so the backend's event-loop lag is not inflated by the load
+generator and mock upstream competing for the same interpreter lock.
+It replays the scripted multi-phase PEARLS sessions in
+benchmarks/scenarios at increasing concurrency. For each concurrency
+level it reports throughput, p50/p95/p99 end-to-end latency, error count
+and event-loop lag of the backend, and writes the results as JSON.
+
+The response cache is disabled unless --cache is given, because replayed
+scripts would otherwise measure the cache rather than the request path.
+
+Usage (from the backend directory):
+    python -m benchmarks.run_bench --concurrency 1 5 10 25 50 --output bench_results.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import statistics
+import time
+import uuid
+
+import httpx
+
+from benchmarks.mock_together import MockServer, _free_port, create_mock_app
+
+SCENARIOS_PATH = os.path.join(os.path.dirname(__file__), "scenarios", "pearls_sessions.json")
+IDLE_LAG_SECONDS = 2.0
+
+
+def percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class EventLoopLagMonitor:
+    """Samples how late asyncio.sleep wakes up on the backend's event loop."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - start - self.interval))
+
+    async def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    def drain(self):
+        samples, self.samples = self.samples, []
+        return samples
+
+
+def _serve_backend(port: int, started, stop):
+    """Child process: serve main.app with a lag monitor whose samples are drained over HTTP."""
+    import main
+
+    logging.getLogger().setLevel(logging.WARNING)
+    monitor = EventLoopLagMonitor()
+    main.app.on_event("startup")(monitor.start)
+    main.app.on_event("shutdown")(monitor.stop)
+    main.app.post("/bench/lag")(monitor.drain)
+    with MockServer(main.app, port):
+        started.set()
+        stop.wait()
+
+
+class BackendProcess:
+    """Runs the backend app in a child process for the duration of a `with` block."""
+
+    def __init__(self, start_timeout: float = 60.0):
+        context = multiprocessing.get_context("spawn")
+        self.port = _free_port()
+        self.start_timeout = start_timeout
+        self._started = context.Event()
+        self._stop = context.Event()
+        self._process = context.Process(target=_serve_backend, args=(self.port, self._started, self._stop), daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self):
+        self._process.start()
+        if not self._started.wait(self.start_timeout):
+            self._process.terminate()
+            raise RuntimeError(f"Backend process did not start (exit code {self._process.exitcode})")
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._process.join(10)
+        if self._process.is_alive():
+            self._process.terminate()
+
+    async def drain_lag(self, client: httpx.AsyncClient) -> list:
+        response = await client.post(self.base_url + "/bench/lag")
+        response.raise_for_status()
+        return response.json()
+
+
+async def replay_session(client: httpx.AsyncClient, script: dict, latencies: list, errors: list):
+    session_id = f"bench-{uuid.uuid4().hex}"
+    for text in script["turns"]:
+        start = time.perf_counter()
+        try:
+            response = await client.post("/debrief", json={"text": text, "session_id": session_id})
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+
+
+async def run_level(backend: BackendProcess, scripts: list, concurrency: int, sessions_per_worker: int) -> dict:
+    latencies = []
+    errors = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=backend.base_url, timeout=120, limits=limits) as client:
+        async def worker(worker_id: int):
+            for i in range(sessions_per_worker):
+                await replay_session(client, scripts[(worker_id + i) % len(scripts)], latencies, errors)
+
+        await backend.drain_lag(client)
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(worker_id) for worker_id in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        lag = await backend.drain_lag(client)
+    return {
+        "concurrency": concurrency,
+        "sessions": concurrency * sessions_per_worker,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "error_samples": errors[:5],
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": round(statistics.fmean(latencies) * 1000, 2) if latencies else 0.0,
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p95": round(percentile(latencies, 95) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+        },
+        "event_loop_lag_ms": _lag_summary(lag),
+    }
+
+
+def _lag_summary(lag: list) -> dict:
+    return {
+        "p50": round(percentile(lag, 50) * 1000, 2),
+        "p99": round(percentile(lag, 99) * 1000, 2),
+        "max": round(max(lag, default=0.0) * 1000, 2),
+    }
+
+
+async def idle_lag(backend: BackendProcess, seconds: float = IDLE_LAG_SECONDS) -> dict:
+    """Lag of the idle backend: the scheduling noise floor of this machine."""
+    async with httpx.AsyncClient(timeout=30) as client:
+        await backend.drain_lag(client)
+        await asyncio.sleep(seconds)
+        return _lag_summary(await backend.drain_lag(client))
+
+
+async def run(args) -> dict:
+    with open(SCENARIOS_PATH, encoding="utf-8") as f:
+        scripts = json.load(f)
+
+    upstream_app = create_mock_app(
+        latency=args.latency,
+        token_delay=args.token_delay,
+        latency_sigma=args.latency_sigma,
+        token_delay_sigma=args.token_delay_sigma,
+        completion_tokens=args.completion_tokens,
+        seed=args.seed,
+    )
+    with MockServer(upstream_app) as upstream:
+        # The child process inherits the environment when it starts
+        os.environ["TOGETHERAI_BASE_URL"] = upstream.base_url
+        levels = []
+        with BackendProcess() as backend:
+            idle = await idle_lag(backend)
+            print(f"idle loop_lag_p99={idle['p99']:6.2f} ms")
+            for concurrency in args.concurrency:
+                level = await run_level(backend, scripts, concurrency, args.sessions_per_worker)
+                levels.append(level)
+                print(
+                    f"concurrency={concurrency:3d} throughput={level['throughput_rps']:8.2f} req/s "
+                    f"p50={level['latency_ms']['p50']:8.1f} ms p95={level['latency_ms']['p95']:8.1f} ms "
+                    f"p99={level['latency_ms']['p99']:8.1f} ms loop_lag_p99={level['event_loop_lag_ms']['p99']:6.2f} ms "
+                    f"errors={level['errors']}"
+                )
+        upstream_requests = upstream_app.state.requests
+
+    return {
+        "benchmark": "debrief_load",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "config": {
+            "latency_s": args.latency,
+            "latency_sigma": args.latency_sigma,
+            "token_delay_s": args.token_delay,
+            "token_delay_sigma": args.token_delay_sigma,
+            "completion_tokens": args.completion_tokens,
+            "sessions_per_worker": args.sessions_per_worker,
+            "response_cache": args.cache,
+            "seed": args.seed,
+        },
+        "upstream_requests": upstream_requests,
+        "idle_event_loop_lag_ms": idle,
+        "levels": levels,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 5, 10, 25, 50])
+    parser.add_argument("--sessions-per-worker", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.3, help="median upstream time to first token (s)")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="lognormal shape of the time to first token")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="median delay per completion token (s)")
+    parser.add_argument("--token-delay-sigma", type=float, default=0.3, help="lognormal shape of the per-token delay")
+    parser.add_argument("--completion-tokens", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--cache", action="store_true", help="leave the response cache enabled")
+    parser.add_argument("--output", help="write JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    os.environ.setdefault("TOGETHERAI_API_KEY", "mock-key")
+    if not args.cache:
+        os.environ["RESPONSE_CACHE_ENABLED"] = "0"
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+Time-to-first-token benchmark for /debrief/stream and /debrief/ws.
+
+Starts the backend app and a fake streaming completion server locally,
+then compares time to first token against the full-response latency of
+the non-streaming /debrief endpoint. The response cache is disabled,
+since every turn repeats the same text and would otherwise be a cache hit.
+
+With --check it instead streams turns over both transports until a phase
+transition and asserts that every turn sends tokens before its done event,
+that time to first token is below the total time, and that the
+phase-transition line arrives as the last token. It exits non-zero if any
+check fails.
+
+Usage (from the backend directory):
+    python -m benchmarks.stream_latency --latency 0.3 --token-delay 0.05 --turns 5
+    python -m benchmarks.stream_latency --check
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+
+import httpx
+import websockets
+
+from benchmarks.mock_together import MockServer, create_mock_app
+
+
+async def _blocking_turn(client: httpx.AsyncClient, session_id: str) -> float:
+    start = time.perf_counter()
+    response = await client.post("/debrief", json={"text": "The handoff felt rushed.", "session_id": session_id})
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+
+async def _sse_turn(client: httpx.AsyncClient, session_id: str):
+    start = time.perf_counter()
+    ttft = None
+    async with client.stream("POST", "/debrief/stream", json={"text": "The handoff felt rushed.", "session_id": session_id}) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if ttft is None and line == "event: token":
+                ttft = time.perf_counter() - start
+    return ttft, time.perf_counter() - start
+
+
+async def _ws_turns(ws_url: str, turns: int):
+    results = []
+    async with websockets.connect(ws_url) as ws:
+        for _ in range(turns):
+            start = time.perf_counter()
+            ttft = None
+            await ws.send(json.dumps({"text": "The handoff felt rushed."}))
+            while True:
+                event = json.loads(await ws.recv())
+                if ttft is None and event["type"] == "token":
+                    ttft = time.perf_counter() - start
+                if event["type"] in ("done", "error"):
+                    break
+            results.append((ttft, time.perf_counter() - start))
+    return results
+
+
+def _ms(values) -> float:
+    return round(statistics.median(values) * 1000, 1)
+
+
+async def run(latency: float, token_delay: float, turns: int):
+    with MockServer(create_mock_app(latency, token_delay)) as upstream:
+        os.environ["TOGETHERAI_BASE_URL"] = upstream.base_url
+        import main
+
+        logging.getLogger().setLevel(logging.WARNING)
+        with MockServer(main.app) as backend:
+            async with httpx.AsyncClient(base_url=backend.base_url, timeout=30) as client:
+                blocking = [await _blocking_turn(client, "bench-blocking") for _ in range(turns)]
+                sse = [await _sse_turn(client, "bench-sse") for _ in range(turns)]
+            ws = await _ws_turns(backend.base_url.replace("http", "ws") + "/debrief/ws", turns)
+
+    results = {
+        "blocking_total_ms": _ms(blocking),
+        "sse_ttft_ms": _ms([ttft for ttft, _ in sse]),
+        "sse_total_ms": _ms([total for _, total in sse]),
+        "ws_ttft_ms": _ms([ttft for ttft, _ in ws]),
+        "ws_total_ms": _ms([total for _, total in ws])
+    }
+    print(json.dumps(results, indent=2))
+    return results
+
+
+TRANSITION_PREFIX = "\n\nWe're now moving to the "
+MAX_CHECK_TURNS = 8
+
+
+async def _sse_events(client: httpx.AsyncClient, body: dict) -> list:
+    events = []
+    start = time.perf_counter()
+    async with client.stream("POST", "/debrief/stream", json=body) as response:
+        response.raise_for_status()
+        event = None
+        async for line in response.aiter_lines():
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                events.append({"type": event, "received_s": time.perf_counter() - start, **json.loads(line[len("data: "):])})
+    return events
+
+
+async def _ws_events(ws, body: dict) -> list:
+    events = []
+    start = time.perf_counter()
+    await ws.send(json.dumps(body))
+    while not events or events[-1]["type"] not in ("done", "error"):
+        events.append({**json.loads(await ws.recv()), "received_s": time.perf_counter() - start})
+    return events
+
+
+def _check_turn(events: list, previous_phase: str) -> str:
+    """Assert the event order and timing of one streamed turn; returns the phase it ended in."""
+    types = [event["type"] for event in events]
+    assert types[-1] == "done" and types.count("done") == 1, f"turn did not end with one done event: {events[-1]}"
+    tokens = [event for event in events if event["type"] == "token"]
+    assert tokens, "no tokens before done"
+    done = events[-1]
+    assert tokens[0]["received_s"] < done["received_s"], "first token arrived with the done event"
+    assert done["ttft_ms"] is not None and done["ttft_ms"] < done["total_ms"], \
+        f"ttft_ms {done['ttft_ms']} is not below total_ms {done['total_ms']}"
+
+    texts = [event["token"] for event in tokens]
+    transitions = [i for i, text in enumerate(texts) if text.startswith(TRANSITION_PREFIX)]
+    if done["phase"] == previous_phase:
+        assert not transitions, f"transition line sent without a phase change: {texts[transitions[0]]!r}"
+    else:
+        expected = f"{TRANSITION_PREFIX}{done['phase'].title()} phase of our debriefing."
+        assert texts[-1] == expected, f"last token is {texts[-1]!r}, expected the transition line"
+        assert transitions == [len(texts) - 1], "transition line is not the last token"
+    return done["phase"]
+
+
+async def _check_session(send_turn) -> None:
+    phase = "PREPARATION"
+    for _ in range(MAX_CHECK_TURNS):
+        next_phase = _check_turn(await send_turn(), phase)
+        if next_phase != phase:
+            return
+    raise AssertionError(f"no phase transition within {MAX_CHECK_TURNS} turns")
+
+
+async def check_sse_stream(client: httpx.AsyncClient, ws_url: str):
+    session_id = None
+
+    async def send_turn():
+        nonlocal session_id
+        body = {"text": "The handoff felt rushed."}
+        if session_id is not None:
+            body["session_id"] = session_id
+        events = await _sse_events(client, body)
+        session_id = events[0]["session_id"]
+        return events
+
+    await _check_session(send_turn)
+
+
+async def check_ws_stream(client: httpx.AsyncClient, ws_url: str):
+    async with websockets.connect(ws_url) as ws:
+        await _check_session(lambda: _ws_events(ws, {"text": "The handoff felt rushed."}))
+
+
+CHECKS = [check_sse_stream, check_ws_stream]
+
+
+async def run_checks(latency: float, token_delay: float) -> bool:
+    passed = True
+    with MockServer(create_mock_app(latency, token_delay)) as upstream:
+        os.environ["TOGETHERAI_BASE_URL"] = upstream.base_url
+        import main
+
+        logging.getLogger().setLevel(logging.CRITICAL)
+        with MockServer(main.app) as backend:
+            async with httpx.AsyncClient(base_url=backend.base_url, timeout=30) as client:
+                for check in CHECKS:
+                    try:
+                        await check(client, backend.base_url.replace("http", "ws") + "/debrief/ws")
+                        print(f"PASS {check.__name__}")
+                    except Exception as e:
+                        passed = False
+                        print(f"FAIL {check.__name__}: {type(e).__name__}: {e}")
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.3, help="upstream delay before the first token (s)")
+    parser.add_argument("--token-delay", type=float, default=0.05, help="upstream delay between tokens (s)")
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--check", action="store_true", help="run the assertion-based streaming checks instead")
+    args = parser.parse_args()
+    os.environ.setdefault("TOGETHERAI_API_KEY", "mock-key")
+    os.environ["RESPONSE_CACHE_ENABLED"] = "0"
+    if args.check:
+        sys.exit(0 if asyncio.run(run_checks(args.latency, args.token_delay)) else 1)
+    asyncio.run(run(args.latency, args.token_delay, args.turns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Time to first audio for a streamed reply, with and without sentence chunking.
+
+Streams a multi-sentence reply token by token and measures when the first
+audio is ready in three modes: synthesizing the full text once the reply
+is complete, the sentence-chunked SpeechPipeline, and the pipeline again
+with the audio cache warm. Uses the offline engine, with synthesis time
+proportional to text length, so the run needs no network access.
+
+Usage (from the backend directory):
+    python -m benchmarks.tts_latency --token-delay 0.02 --seconds-per-char 0.003
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from speech import AudioCache, OfflineEngine, SpeechPipeline
+
+REPLY = (
+    "Thank you for sharing that. It sounds like the team recognized the shock early. "
+    "What made you decide to start the second fluid bolus when you did? "
+    "Many teams hesitate at that point, so your reasoning would help everyone here. "
+    "Let's also talk about how roles were assigned once the infant deteriorated."
+)
+
+
+async def stream_tokens(token_delay: float):
+    for i, word in enumerate(REPLY.split(" ")):
+        await asyncio.sleep(token_delay)
+        yield word if i == 0 else " " + word
+
+
+async def full_reply(pipeline: SpeechPipeline, token_delay: float) -> dict:
+    start = time.perf_counter()
+    text = "".join([token async for token in stream_tokens(token_delay)])
+    await pipeline.synthesize(text)
+    elapsed = (time.perf_counter() - start) * 1000
+    return {"mode": "full_reply", "first_audio_ms": round(elapsed, 1), "last_audio_ms": round(elapsed, 1), "chunks": 1}
+
+
+async def sentence_pipeline(mode: str, pipeline: SpeechPipeline, token_delay: float) -> dict:
+    start = time.perf_counter()
+    audio_times = []
+    async for kind, _ in pipeline.speak(stream_tokens(token_delay)):
+        if kind == "audio":
+            audio_times.append((time.perf_counter() - start) * 1000)
+    return {
+        "mode": mode,
+        "first_audio_ms": round(audio_times[0], 1),
+        "last_audio_ms": round(audio_times[-1], 1),
+        "chunks": len(audio_times),
+    }
+
+
+async def run(args):
+    engine = OfflineEngine(seconds_per_char=args.seconds_per_char)
+    results = [await full_reply(SpeechPipeline(engine, AudioCache()), args.token_delay)]
+    pipeline = SpeechPipeline(engine, AudioCache(), workers=args.workers)
+    results.append(await sentence_pipeline("sentence_chunks", pipeline, args.token_delay))
+    results.append(await sentence_pipeline("sentence_chunks_cached", pipeline, args.token_delay))
+    for result in results:
+        print(json.dumps(result))
+    print(json.dumps({"cache": pipeline.cache.stats()}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--token-delay", type=float, default=0.02, help="delay between streamed tokens (s)")
+    parser.add_argument("--seconds-per-char", type=float, default=0.003, help="offline engine synthesis time per character (s)")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
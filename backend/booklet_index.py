@@ -0,0 +1,239 @@
+import asyncio
+import hashlib
+import html
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Dict, List
+from urllib.parse import urljoin, urlsplit
+
+import httpx
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have he her his i in is it its of on or she that the their them "
+    "they this to was were what when which who will with you your we our".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def html_to_text(raw: str) -> str:
+    raw = re.sub(r"(?is)<(script|style).*?</\1>", " ", raw)
+    raw = re.sub(r"(?i)<br\s*/?>|</p>|</li>|</h\d>", "\n", raw)
+    return html.unescape(re.sub(r"<[^>]+>", " ", raw))
+
+
+def chunk_text(text: str, chunk_words: int = 120, overlap: int = 30) -> List[str]:
+    """Split text into overlapping windows of roughly chunk_words words."""
+    words = text.split()
+    if not words:
+        return []
+    step = max(chunk_words - overlap, 1)
+    return [" ".join(words[start:start + chunk_words]) for start in range(0, max(len(words) - overlap, 1), step)]
+
+
+class BookletIndex:
+    """
+    BM25 index over booklet chunks, stored term-major in flat NumPy arrays:
+    the postings of term t are doc_ids/weights[indptr[t]:indptr[t + 1]],
+    with the full BM25 weight precomputed so a query is a handful of
+    vectorized scatter-adds.
+    """
+
+    def __init__(self, chunks: List[str], vocab: Dict[str, int], indptr: np.ndarray, doc_ids: np.ndarray,
+                 weights: np.ndarray):
+        self.chunks = chunks
+        self.vocab = vocab
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.weights = weights
+
+    @classmethod
+    def build(cls, chunks: List[str], k1: float = 1.5, b: float = 0.75) -> "BookletIndex":
+        doc_terms = [Counter(tokenize(chunk)) for chunk in chunks]
+        doc_lengths = np.array([sum(terms.values()) for terms in doc_terms], dtype=np.float32)
+        avg_length = float(doc_lengths.mean()) if len(chunks) else 0.0
+
+        postings: Dict[str, List] = {}
+        for doc_id, terms in enumerate(doc_terms):
+            for term, tf in terms.items():
+                postings.setdefault(term, []).append((doc_id, tf))
+
+        vocab = {term: term_id for term_id, term in enumerate(sorted(postings))}
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int32)
+        doc_ids = []
+        weights = []
+        for term, term_id in vocab.items():
+            docs = postings[term]
+            idf = math.log(1 + (len(chunks) - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id, tf in docs:
+                norm = k1 * (1 - b + b * doc_lengths[doc_id] / avg_length)
+                doc_ids.append(doc_id)
+                weights.append(idf * tf * (k1 + 1) / (tf + norm))
+            indptr[term_id + 1] = len(doc_ids)
+        return cls(chunks, vocab, indptr, np.array(doc_ids, dtype=np.int32), np.array(weights, dtype=np.float32))
+
+    def search(self, query: str, k: int = 3) -> List[str]:
+        term_ids = {self.vocab[term] for term in tokenize(query) if term in self.vocab}
+        if not term_ids:
+            return []
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        for term_id in term_ids:
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            scores[self.doc_ids[start:end]] += self.weights[start:end]
+        k = min(k, len(self.chunks))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [self.chunks[i] for i in top if scores[i] > 0]
+
+    def save(self, path: str):
+        meta = json.dumps({"chunks": self.chunks, "vocab": self.vocab})
+        # Unique per writer: several workers may build the same booklet at once
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+        np.savez(tmp_path, indptr=self.indptr, doc_ids=self.doc_ids, weights=self.weights, meta=np.array(meta))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BookletIndex":
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            return cls(meta["chunks"], meta["vocab"], data["indptr"], data["doc_ids"], data["weights"])
+
+
+class BookletRegistry:
+    """
+    Shares one BookletIndex per case booklet across every session.
+    Sources are fetched once per process, indexes are cached on disk by
+    content hash so a restart or another worker skips re-parsing, and
+    concurrent first requests for the same booklet wait on a single build.
+    The source is client-supplied, so remote booklets are only fetched from
+    hosts in BOOKLET_ALLOWED_HOSTS, downloads are capped at
+    BOOKLET_MAX_BYTES, and the per-source maps are bounded LRUs.
+    """
+
+    RETRY_FAILED_AFTER = 300
+    MAX_REDIRECTS = 3
+
+    def __init__(self, cache_dir: str = None, top_k: int = None, booklet_dir: str = None, allowed_hosts: str = None,
+                 max_bytes: int = None, max_indexes: int = None):
+        # Local booklets are only read from here, so a client-supplied path cannot reach other files
+        self.booklet_dir = os.path.realpath(booklet_dir or os.getenv("BOOKLET_DIR", os.path.join(os.path.dirname(__file__), "booklets")))
+        self.cache_dir = cache_dir or os.getenv("BOOKLET_CACHE_DIR", os.path.join(os.path.dirname(__file__), ".booklet_cache"))
+        self.top_k = top_k or int(os.getenv("BOOKLET_TOP_K", "3"))
+        allowed_hosts = allowed_hosts if allowed_hosts is not None else os.getenv("BOOKLET_ALLOWED_HOSTS", "")
+        self.allowed_hosts = {host.strip().lower() for host in allowed_hosts.split(",") if host.strip()}
+        self.max_bytes = max_bytes or int(os.getenv("BOOKLET_MAX_BYTES", str(5 * 1024 * 1024)))
+        self.max_indexes = max_indexes or int(os.getenv("BOOKLET_MAX_INDEXES", "64"))
+        self._indexes: "OrderedDict[str, BookletIndex]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._failed: "OrderedDict[str, float]" = OrderedDict()
+
+    def _check_url(self, url: str):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or (parts.hostname or "").lower() not in self.allowed_hosts:
+            raise ValueError(f"Booklet host {parts.hostname} is not in BOOKLET_ALLOWED_HOSTS")
+
+    async def _fetch(self, source: str) -> str:
+        if source.startswith(("http://", "https://")):
+            return await self._fetch_url(source)
+        return await asyncio.to_thread(self._read_file, source)
+
+    async def _fetch_url(self, url: str) -> str:
+        async with httpx.AsyncClient(timeout=30) as client:
+            # Redirects are followed by hand so every hop is checked against the allow-list
+            for _ in range(self.MAX_REDIRECTS + 1):
+                self._check_url(url)
+                async with client.stream("GET", url) as response:
+                    if response.is_redirect:
+                        url = urljoin(url, response.headers["location"])
+                        continue
+                    response.raise_for_status()
+                    body = bytearray()
+                    async for chunk in response.aiter_bytes():
+                        body += chunk
+                        if len(body) > self.max_bytes:
+                            raise ValueError(f"Booklet {url} is larger than {self.max_bytes} bytes")
+                    text = bytes(body).decode(response.encoding or "utf-8", errors="replace")
+                    if "html" in response.headers.get("content-type", ""):
+                        text = html_to_text(text)
+                    return text
+        raise ValueError(f"Booklet {url} redirected more than {self.MAX_REDIRECTS} times")
+
+    def _read_file(self, source: str) -> str:
+        path = os.path.realpath(os.path.join(self.booklet_dir, source))
+        if os.path.commonpath([path, self.booklet_dir]) != self.booklet_dir:
+            raise ValueError(f"Booklet {source} is outside {self.booklet_dir}")
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        return html_to_text(text) if path.endswith((".html", ".htm")) else text
+
+    def _load_or_build(self, text: str) -> BookletIndex:
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        path = os.path.join(self.cache_dir, f"{digest}.npz")
+        if os.path.exists(path):
+            try:
+                return BookletIndex.load(path)
+            except Exception as e:
+                logger.warning("Ignoring unreadable booklet index %s: %s", path, e)
+        index = BookletIndex.build(chunk_text(text))
+        os.makedirs(self.cache_dir, exist_ok=True)
+        index.save(path)
+        logger.info("Built booklet index %s with %d chunks", digest[:12], len(index.chunks))
+        return index
+
+    async def _build(self, source: str) -> BookletIndex:
+        text = await self._fetch(source)
+        index = await asyncio.to_thread(self._load_or_build, text)
+        self._remember(source, index)
+        return index
+
+    def _finish_pending(self, source: str, task: asyncio.Future):
+        self._pending.pop(source, None)
+        if not task.cancelled():
+            task.exception()
+
+    def _remember(self, source: str, index: BookletIndex):
+        self._indexes[source] = index
+        self._indexes.move_to_end(source)
+        while len(self._indexes) > self.max_indexes:
+            self._indexes.popitem(last=False)
+
+    async def get(self, source: str) -> BookletIndex:
+        index = self._indexes.get(source)
+        if index is not None:
+            self._indexes.move_to_end(source)
+            return index
+        pending = self._pending.get(source)
+        if pending is None:
+            # Shielded so a cancelled first request does not cancel the build for the sessions waiting on it
+            pending = asyncio.ensure_future(self._build(source))
+            self._pending[source] = pending
+            pending.add_done_callback(lambda done: self._finish_pending(source, done))
+        return await asyncio.shield(pending)
+
+    async def passages(self, source: str, query: str) -> List[str]:
+        """Top-k booklet passages for query; an unreachable booklet yields none rather than failing the turn."""
+        failed_at = self._failed.get(source)
+        if failed_at is not None and time.monotonic() - failed_at < self.RETRY_FAILED_AFTER:
+            return []
+        try:
+            index = await self.get(source)
+        except Exception as e:
+            logger.warning("Could not load case booklet %s: %s", source, e)
+            self._failed[source] = time.monotonic()
+            self._failed.move_to_end(source)
+            while len(self._failed) > self.max_indexes * 16:
+                self._failed.popitem(last=False)
+            return []
+        return index.search(query, self.top_k)
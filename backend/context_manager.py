@@ -0,0 +1,121 @@
+import logging
+import os
+import re
+from typing import Callable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Rough per-message framing cost of the chat template (role markers, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate (~4 characters per token for English prose).
+    Good enough for budgeting; it does not need to match the Mixtral tokenizer exactly.
+    """
+    return len(text) // 4 + 1
+
+
+def extractive_summary(phase_name: str, messages: List[Dict], max_chars: int = 600) -> str:
+    """
+    Summarize a finished phase without another upstream call: keep the first
+    sentence of each learner utterance, most recent first, up to max_chars.
+    """
+    points = []
+    used = 0
+    for msg in reversed(messages):
+        if msg["role"] != "user":
+            continue
+        sentence = re.split(r"(?<=[.!?])\s", msg["content"].strip(), maxsplit=1)[0]
+        if used + len(sentence) > max_chars:
+            break
+        points.append(sentence)
+        used += len(sentence)
+    points.reverse()
+    return f"Summary of the {phase_name.title()} phase. Learner said: " + " | ".join(points)
+
+
+class ContextStats:
+    def __init__(self, tokens_in: int, tokens_out: int, messages_in: int, messages_out: int):
+        self.tokens_in = tokens_in
+        self.tokens_out = tokens_out
+        self.messages_in = messages_in
+        self.messages_out = messages_out
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_in - self.tokens_out
+
+    def to_dict(self) -> Dict:
+        return {
+            "prompt_tokens": self.tokens_out,
+            "tokens_saved": self.tokens_saved,
+            "messages_sent": self.messages_out
+        }
+
+
+class ContextManager:
+    """
+    Assembles the upstream message list under a token budget.
+    The system message and the latest `min_recent` messages are always sent
+    verbatim. While the prompt is over budget, the older turns of finished
+    phases are replaced by their summaries, oldest phase first; if it is
+    still over budget, the oldest verbatim turns and then the oldest
+    summaries are dropped.
+    """
+
+    def __init__(self, budget_tokens: int = None, min_recent: int = 2,
+                 summarizer: Callable[[str, List[Dict]], str] = extractive_summary,
+                 count_tokens: Callable[[str], int] = estimate_tokens):
+        self.budget_tokens = budget_tokens or int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+        self.min_recent = min_recent
+        self.summarizer = summarizer
+        self.count_tokens = count_tokens
+
+    def _message_tokens(self, msg: Dict) -> int:
+        return self.count_tokens(msg["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+    def summarize_phase(self, phase_name: str, phase_value: str, messages: List[Dict]) -> str:
+        return self.summarizer(phase_name, [msg for msg in messages if msg.get("phase") == phase_value])
+
+    def assemble(self, system_message: str, messages: List[Dict], summaries: Dict[str, str] = None) -> Tuple[List[Dict], ContextStats]:
+        """
+        `summaries` maps a phase value (e.g. "P") to its cached summary.
+        Messages are tagged with the phase they were sent in; untagged
+        messages (stateless clients) are never summarized.
+        """
+        summaries = summaries or {}
+        system = {"role": "system", "content": system_message}
+        tokens_in = self._message_tokens(system) + sum(self._message_tokens(msg) for msg in messages)
+
+        recent_start = max(0, len(messages) - self.min_recent)
+        older = [(msg.get("phase"), {"role": msg["role"], "content": msg["content"]}) for msg in messages[:recent_start]]
+        recent = [{"role": msg["role"], "content": msg["content"]} for msg in messages[recent_start:]]
+        total = tokens_in
+
+        summary_messages = []
+        for phase in dict.fromkeys(phase for phase, _ in older):
+            if total <= self.budget_tokens:
+                break
+            if phase not in summaries:
+                continue
+            summary = {"role": "system", "content": summaries[phase]}
+            saved = sum(self._message_tokens(msg) for p, msg in older if p == phase) - self._message_tokens(summary)
+            if saved <= 0:
+                continue
+            older = [(p, msg) for p, msg in older if p != phase]
+            summary_messages.append(summary)
+            total -= saved
+
+        older = [msg for _, msg in older]
+        while total > self.budget_tokens and older:
+            total -= self._message_tokens(older.pop(0))
+        while total > self.budget_tokens and summary_messages:
+            total -= self._message_tokens(summary_messages.pop(0))
+
+        assembled = [system] + summary_messages + older + recent
+        stats = ContextStats(tokens_in, total, len(messages) + 1, len(assembled))
+        if stats.tokens_saved:
+            logger.debug("Context assembled: %d tokens, %d saved", stats.tokens_out, stats.tokens_saved)
+        return assembled, stats
@@ -0,0 +1,145 @@
+import asyncio
+import json
+import os
+import logging
+from typing import AsyncIterator, Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = "https://api.together.xyz"
+CHAT_COMPLETIONS_PATH = "/v1/chat/completions"
+
+
+def describe_payload(payload: Dict, max_chars: int = 80) -> str:
+    """Short, credential-free description of a completion request for debug logs."""
+    messages = payload.get("messages", [])
+    last = messages[-1]["content"] if messages else ""
+    if len(last) > max_chars:
+        last = last[:max_chars] + "..."
+    return f"model={payload.get('model')} messages={len(messages)} max_tokens={payload.get('max_tokens')} last={last!r}"
+
+
+def truncate(text: str, max_chars: int = 500) -> str:
+    return text if len(text) <= max_chars else f"{text[:max_chars]}... ({len(text)} chars)"
+
+
+class LLMClientConfig:
+    """Connection pool, timeout and concurrency settings for the upstream LLM API."""
+
+    def __init__(
+        self,
+        base_url: str = None,
+        connect_timeout: float = None,
+        read_timeout: float = None,
+        max_connections: int = None,
+        max_keepalive_connections: int = None,
+        max_concurrency: int = None,
+    ):
+        self.base_url = base_url or os.getenv("TOGETHERAI_BASE_URL", DEFAULT_BASE_URL)
+        self.connect_timeout = connect_timeout if connect_timeout is not None else float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+        self.read_timeout = read_timeout if read_timeout is not None else float(os.getenv("LLM_READ_TIMEOUT", "60"))
+        self.max_connections = max_connections or int(os.getenv("LLM_MAX_CONNECTIONS", "64"))
+        self.max_keepalive_connections = max_keepalive_connections or int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "32"))
+        self.max_concurrency = max_concurrency or int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+
+    @property
+    def url(self) -> str:
+        return self.base_url.rstrip("/") + CHAT_COMPLETIONS_PATH
+
+
+class AsyncLLMClient:
+    """
+    Non-blocking client for the Together AI chat completions endpoint.
+    A single keep-alive connection pool is shared by every request, and a
+    semaphore bounds how many completions are in flight at once so a burst
+    of learners cannot exhaust the pool or the upstream rate limit.
+    """
+
+    def __init__(self, api_key: str, config: LLMClientConfig = None):
+        self.api_key = api_key
+        self.config = config or LLMClientConfig()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # Created lazily so the pool is bound to the running event loop
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json"
+                },
+                timeout=httpx.Timeout(
+                    self.config.read_timeout,
+                    connect=self.config.connect_timeout
+                ),
+                limits=httpx.Limits(
+                    max_connections=self.config.max_connections,
+                    max_keepalive_connections=self.config.max_keepalive_connections
+                ),
+            )
+            self._semaphore = asyncio.Semaphore(self.config.max_concurrency)
+        return self._client
+
+    def slot(self) -> asyncio.Semaphore:
+        """
+        The semaphore bounding in-flight completions. Callers that time the
+        upstream call hold a slot themselves and use post_completion or
+        stream_completion, so time spent queued for a slot is not counted.
+        """
+        self._get_client()
+        return self._semaphore
+
+    async def chat_completion(self, payload: Dict) -> Dict:
+        async with self.slot():
+            return await self.post_completion(payload)
+
+    async def post_completion(self, payload: Dict) -> Dict:
+        """Send one completion request; the caller must hold a slot()."""
+        client = self._get_client()
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Sending completion request: %s", describe_payload(payload))
+        response = await client.post(self.config.url, json=payload)
+        if response.status_code != 200:
+            logger.error("Together AI API error: status=%s body=%s", response.status_code, truncate(response.text))
+            response.raise_for_status()
+        return response.json()
+
+    async def stream_chat_completion(self, payload: Dict) -> AsyncIterator[str]:
+        """
+        Yield content deltas from a `stream: true` completion as they arrive.
+        The concurrency slot is held until the stream is exhausted or closed.
+        """
+        async with self.slot():
+            async for delta in self.stream_completion(payload):
+                yield delta
+
+    async def stream_completion(self, payload: Dict) -> AsyncIterator[str]:
+        """Streaming counterpart of post_completion; the caller must hold a slot() until the stream is closed."""
+        client = self._get_client()
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Sending streaming completion request: %s", describe_payload(payload))
+        async with client.stream("POST", self.config.url, json={**payload, "stream": True}) as response:
+            if response.status_code != 200:
+                await response.aread()
+                logger.error("Together AI API error: status=%s body=%s", response.status_code, truncate(response.text))
+                response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                if not chunk.get("choices"):
+                    continue
+                delta = chunk["choices"][0].get("delta", {}).get("content")
+                if delta:
+                    yield delta
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
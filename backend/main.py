@@ -1,9 +1,19 @@
+import base64
+import json
 import logging
-from fastapi import FastAPI, HTTPException
+import time
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
 import uvicorn
 from pearls_model import PEARLSModel
+from session_store import SessionConflictError, SessionStore
+from batch import Checkpoint, RateLimiter, parse_jsonl, run_batch
+from speech import SpeechPipeline, VoiceSettings
+from llm_client import truncate
+from upstream_router import CircuitOpenError
+import metrics
 import os
 
 # Configure logging
@@ -23,22 +33,41 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+app.add_middleware(metrics.RequestTimingMiddleware)
+
 class DebriefRequest(BaseModel):
     text: str
     caseBookletLink: str = None
     conversation_history: list = None
+    session_id: str = None
+    speak: bool = False
+    voice: dict = None
 
 class DebriefResponse(BaseModel):
     response: str
+    session_id: str = None
+    phase: str = None
+    tokens_saved: int = None
 
 # Initialize PEARLS model
 try:
     pearls_model = PEARLSModel()
     logger.info("PEARLS model initialized successfully")
 except Exception as e:
-    logger.error(f"Failed to initialize PEARLS model: {e}")
+    logger.error("Failed to initialize PEARLS model: %s", e)
     pearls_model = None
 
+session_store = SessionStore.from_env()
+# A turn that loses a save race to another worker is redone on the reloaded session
+SESSION_SAVE_ATTEMPTS = 2
+
+try:
+    speech_pipeline = SpeechPipeline()
+    logger.info("Speech pipeline initialized with %s engine", speech_pipeline.engine.name)
+except Exception as e:
+    logger.error("Failed to initialize speech pipeline: %s", e)
+    speech_pipeline = None
+
 # Update environment variable validation and health check for TOGETHERAI
 TOGETHERAI_API_KEY = os.getenv("TOGETHERAI_API_KEY")
 
@@ -50,22 +79,291 @@ def health_check():
         "api_key_configured": bool(TOGETHERAI_API_KEY)
     }
 
+def _collect_runtime_metrics():
+    lines = [
+        "# HELP debrief_sessions_in_memory Debrief sessions held in this worker's LRU",
+        "# TYPE debrief_sessions_in_memory gauge",
+        f"debrief_sessions_in_memory {len(session_store)}"
+    ]
+    if pearls_model is not None:
+        stats = pearls_model.response_cache.stats()
+        lines += [
+            "# HELP debrief_response_cache_hits_total Completions served from the response cache, including coalesced requests",
+            "# TYPE debrief_response_cache_hits_total counter",
+            f"debrief_response_cache_hits_total {stats['hits']}",
+            "# HELP debrief_response_cache_misses_total Completions fetched upstream for cacheable turns",
+            "# TYPE debrief_response_cache_misses_total counter",
+            f"debrief_response_cache_misses_total {stats['misses']}",
+            "# HELP debrief_response_cache_latency_saved_seconds_total Estimated upstream latency avoided by cache hits",
+            "# TYPE debrief_response_cache_latency_saved_seconds_total counter",
+            f"debrief_response_cache_latency_saved_seconds_total {stats['latency_saved_seconds']}",
+            "# HELP debrief_upstream_circuit_open Whether the upstream circuit breaker for a model is open (1) or half-open (0.5)",
+            "# TYPE debrief_upstream_circuit_open gauge"
+        ]
+        for model, state in pearls_model.router.breaker_states().items():
+            value = {"closed": 0, "half_open": 0.5, "open": 1}[state]
+            lines.append(f'debrief_upstream_circuit_open{{model="{model}"}} {value}')
+    if speech_pipeline is not None:
+        stats = speech_pipeline.cache.stats()
+        lines += [
+            "# HELP debrief_tts_cache_hits_total Speech chunks served from the audio cache, including coalesced requests",
+            "# TYPE debrief_tts_cache_hits_total counter",
+            f"debrief_tts_cache_hits_total {stats['hits']}",
+            "# HELP debrief_tts_cache_misses_total Speech chunks synthesized by the TTS engine",
+            "# TYPE debrief_tts_cache_misses_total counter",
+            f"debrief_tts_cache_misses_total {stats['misses']}",
+            "# HELP debrief_tts_cache_bytes Audio bytes held in this worker's in-memory cache",
+            "# TYPE debrief_tts_cache_bytes gauge",
+            f"debrief_tts_cache_bytes {stats['bytes']}"
+        ]
+    return lines
+
+metrics.registry.add_collector(_collect_runtime_metrics)
+
+@app.get("/metrics")
+def metrics_endpoint():
+    return PlainTextResponse(metrics.registry.expose(), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats")
+def cache_stats():
+    return pearls_model.response_cache.stats() if pearls_model is not None else {}
+
+@app.on_event("shutdown")
+async def shutdown():
+    if pearls_model is not None:
+        await pearls_model.aclose()
+    if speech_pipeline is not None:
+        speech_pipeline.close()
+
 @app.post("/debrief")
 async def debrief(request: DebriefRequest):
     try:
-        logger.info(f"Received debrief request: {request.text[:100]}... Case booklet: {request.caseBookletLink}")
-        response = pearls_model.process_input(
-            request.text,
-            conversation_history=request.conversation_history,
-            case_booklet_link=request.caseBookletLink
-        )
+        metrics.observe_request_parse()
+        logger.info("Received debrief request: session=%s chars=%d booklet=%s", request.session_id, len(request.text), request.caseBookletLink)
+        if request.conversation_history is not None:
+            # Legacy stateless mode: the client owns the transcript
+            response = await pearls_model.aprocess_input(
+                request.text,
+                conversation_history=request.conversation_history,
+                case_booklet_link=request.caseBookletLink
+            )
+            logger.info("Successfully generated response")
+            return {"response": response}
+
+        session = await session_store.get_or_create(request.session_id, request.caseBookletLink)
+        async with session.lock:
+            for attempt in range(SESSION_SAVE_ATTEMPTS):
+                if request.caseBookletLink:
+                    session.case_booklet_link = request.caseBookletLink
+                response = await pearls_model.aprocess_turn(session, request.text)
+                try:
+                    await session_store.save(session)
+                    break
+                except SessionConflictError as e:
+                    reloaded = await session_store.get(session.session_id)
+                    if attempt + 1 == SESSION_SAVE_ATTEMPTS or reloaded is None:
+                        raise
+                    logger.warning("Redoing turn after a concurrent update: %s", e)
+                    session = reloaded
         logger.info("Successfully generated response")
-        return {"response": response}
+        return {
+            "response": response,
+            "session_id": session.session_id,
+            "phase": session.phase.name,
+            "tokens_saved": session.context_stats.tokens_saved
+        }
+    except CircuitOpenError as e:
+        logger.error("Upstream unavailable: %s", e)
+        raise HTTPException(status_code=503, detail=str(e))
+    except SessionConflictError as e:
+        logger.error("Session conflict: %s", e)
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
-        logger.error(f"Error in debrief endpoint: {str(e)}")
+        logger.error("Error in debrief endpoint: %s", e)
         if hasattr(e, 'response') and e.response is not None:
-            logger.error(f"API error response: {e.response.text}")
+            logger.error("API error response: %s", truncate(e.response.text))
         raise HTTPException(status_code=500, detail=str(e))
 
+def _voice_for(request: DebriefRequest):
+    """Validated voice settings when the turn should be spoken; raises ValueError for a bad voice."""
+    if not request.speak:
+        return None
+    if speech_pipeline is None:
+        raise ValueError("Speech pipeline is not available")
+    return VoiceSettings.from_dict(request.voice)
+
+async def _turn_events(request: DebriefRequest, session, voice: VoiceSettings = None):
+    tokens = pearls_model.astream_turn(session, request.text)
+    if voice is None:
+        async for token in tokens:
+            yield "token", token
+        return
+    async for event in speech_pipeline.speak(tokens, voice):
+        yield event
+
+async def _stream_turn(request: DebriefRequest, voice: VoiceSettings = None):
+    """
+    Run one streamed turn and yield (event, data) pairs: a "session" event,
+    one "token" event per chunk, then a "done" event with the new phase and
+    time to first token, or an "error" event if the upstream call fails.
+    With a voice, an "audio" event carries each synthesized sentence as
+    soon as it is ready.
+    """
+    session = await session_store.get_or_create(request.session_id, request.caseBookletLink)
+    yield "session", {"session_id": session.session_id}
+    async with session.lock:
+        if request.caseBookletLink:
+            session.case_booklet_link = request.caseBookletLink
+        start = time.perf_counter()
+        ttft_ms = None
+        ttfa_ms = None
+        try:
+            async for kind, value in _turn_events(request, session, voice):
+                if kind == "token":
+                    if ttft_ms is None:
+                        ttft_ms = (time.perf_counter() - start) * 1000
+                    yield "token", {"token": value}
+                else:
+                    if ttfa_ms is None:
+                        ttfa_ms = (time.perf_counter() - start) * 1000
+                    yield "audio", {
+                        "index": value.index,
+                        "text": value.text,
+                        "media_type": value.media_type,
+                        "audio": base64.b64encode(value.audio).decode("ascii")
+                    }
+        except Exception as e:
+            logger.error("Error in streaming debrief: %s", e)
+            yield "error", {"detail": str(e)}
+            return
+        try:
+            await session_store.save(session)
+        except SessionConflictError as e:
+            # The tokens have already been sent, so the client has to resend the turn
+            logger.error("Session conflict in streaming debrief: %s", e)
+            yield "error", {"detail": str(e)}
+            return
+    done = {
+        "session_id": session.session_id,
+        "phase": session.phase.name,
+        "tokens_saved": session.context_stats.tokens_saved,
+        "ttft_ms": round(ttft_ms, 1) if ttft_ms is not None else None,
+        "total_ms": round((time.perf_counter() - start) * 1000, 1)
+    }
+    if voice is not None:
+        done["ttfa_ms"] = round(ttfa_ms, 1) if ttfa_ms is not None else None
+    yield "done", done
+
+@app.post("/debrief/stream")
+async def debrief_stream(request: DebriefRequest):
+    metrics.observe_request_parse()
+    logger.info("Received streaming debrief request: session=%s chars=%d booklet=%s", request.session_id, len(request.text), request.caseBookletLink)
+    if request.speak and speech_pipeline is None:
+        raise HTTPException(status_code=503, detail="Speech pipeline is not available")
+    try:
+        voice = _voice_for(request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def events():
+        async for event, data in _stream_turn(request, voice):
+            yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.websocket("/debrief/ws")
+async def debrief_ws(websocket: WebSocket):
+    """Accepts one DebriefRequest JSON message per turn and replies with the same events as /debrief/stream."""
+    await websocket.accept()
+    session_id = None
+    try:
+        while True:
+            try:
+                request = DebriefRequest(**await websocket.receive_json())
+            except (ValidationError, TypeError, ValueError) as e:
+                # A malformed message is answered like a bad voice setting; the socket stays open
+                await websocket.send_json({"type": "error", "detail": f"Invalid request: {e}"})
+                continue
+            if request.session_id is None:
+                request.session_id = session_id
+            try:
+                voice = _voice_for(request)
+            except ValueError as e:
+                await websocket.send_json({"type": "error", "detail": str(e)})
+                continue
+            async for event, data in _stream_turn(request, voice):
+                if event == "session":
+                    session_id = data["session_id"]
+                await websocket.send_json({"type": event, **data})
+    except WebSocketDisconnect:
+        logger.info("WebSocket closed for session %s", session_id)
+
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "16"))
+BATCH_CHECKPOINT_DIR = os.getenv("BATCH_CHECKPOINT_DIR")
+
+@app.post("/debrief/batch")
+async def debrief_batch(request: Request, concurrency: int = 8, batch_id: str = None):
+    """
+    Accepts a JSONL body of recorded sessions and streams back one JSONL
+    result per session as each finishes. With a batch_id (and
+    BATCH_CHECKPOINT_DIR set), resubmitting the same batch skips sessions
+    that already completed.
+    """
+    # The body is read up front: StreamingResponse listens for disconnects on the same receive channel
+    lines = (await request.body()).decode("utf-8").splitlines()
+    checkpoint = None
+    if batch_id is not None:
+        if not BATCH_CHECKPOINT_DIR:
+            raise HTTPException(status_code=400, detail="batch_id requires BATCH_CHECKPOINT_DIR to be configured")
+        if not batch_id.replace("-", "").replace("_", "").isalnum():
+            raise HTTPException(status_code=400, detail="batch_id may only contain letters, digits, '-' and '_'")
+        os.makedirs(BATCH_CHECKPOINT_DIR, exist_ok=True)
+        checkpoint = Checkpoint(os.path.join(BATCH_CHECKPOINT_DIR, f"{batch_id}.checkpoint"))
+    concurrency = max(1, min(concurrency, BATCH_MAX_CONCURRENCY))
+    rate_limiter = RateLimiter(float(os.getenv("BATCH_REQUESTS_PER_MINUTE", "0")))
+    logger.info("Received batch debrief request: batch=%s concurrency=%d", batch_id, concurrency)
+
+    async def results():
+        try:
+            async for result in run_batch(pearls_model, parse_jsonl(lines), concurrency, checkpoint, rate_limiter):
+                yield json.dumps(result) + "\n"
+        finally:
+            if checkpoint is not None:
+                checkpoint.close()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+class SpeechRequest(BaseModel):
+    text: str
+    voice: dict = None
+
+@app.post("/tts")
+async def text_to_speech(request: SpeechRequest):
+    """Synthesize text with the server-side engine. The ETag is the content address, so clients can cache it too."""
+    if speech_pipeline is None:
+        raise HTTPException(status_code=503, detail="Speech pipeline is not available")
+    if not request.text.strip():
+        raise HTTPException(status_code=400, detail="text must not be empty")
+    try:
+        voice = VoiceSettings.from_dict(request.voice)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        audio, key = await speech_pipeline.synthesize(request.text, voice)
+    except Exception as e:
+        logger.error("Error in text to speech: %s", e)
+        raise HTTPException(status_code=502, detail=str(e))
+    return Response(audio, media_type=speech_pipeline.engine.media_type,
+                    headers={"ETag": f'"{key}"', "Cache-Control": "public, max-age=31536000, immutable"})
+
+@app.get("/tts/stats")
+def tts_stats():
+    return speech_pipeline.cache.stats() if speech_pipeline is not None else {}
+
+@app.delete("/sessions/{session_id}")
+async def end_session(session_id: str):
+    await session_store.delete(session_id)
+    return {"status": "ok"}
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True) 
\ No newline at end of file
@@ -0,0 +1,177 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Tuple
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Set by the request middleware so handlers can time how long parsing took
+request_started_at: contextvars.ContextVar = contextvars.ContextVar("request_started_at", default=None)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        # labels -> (per-bucket counts incl. +Inf, sum, count)
+        self._values: Dict[Labels, List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            entry = self._values.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0, 0])
+            entry[0][bisect.bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(labels, (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Minimal Prometheus text-format registry; collectors add values computed at scrape time."""
+
+    def __init__(self):
+        self._metrics: List = []
+        self._collectors: List[Callable[[], List[str]]] = []
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        metric = Counter(name, help_text)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], List[str]]):
+        self._collectors.append(collector)
+
+    def expose(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.expose())
+        for collector in self._collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+stage_seconds = registry.histogram(
+    "debrief_stage_seconds",
+    "Latency of each debrief turn stage (request_parse, booklet_retrieval, prompt_assembly, upstream_wait, phase_transition, tts_synthesis)"
+)
+request_seconds = registry.histogram("debrief_request_seconds", "End-to-end HTTP request latency by route")
+prompt_tokens = registry.counter("debrief_prompt_tokens_total", "Prompt tokens sent upstream by phase")
+completion_tokens = registry.counter("debrief_completion_tokens_total", "Completion tokens received by phase")
+tokens_saved = registry.counter("debrief_context_tokens_saved_total", "Prompt tokens removed by context budgeting by phase")
+errors = registry.counter("debrief_errors_total", "Failed debrief turns by phase")
+upstream_retries = registry.counter("debrief_upstream_retries_total", "Upstream calls retried after a transient failure by model")
+upstream_hedges = registry.counter("debrief_upstream_hedges_total", "Hedged second attempts fired by model")
+
+
+class RequestTimingMiddleware:
+    """
+    Pure ASGI middleware recording debrief_request_seconds by route. The
+    clock stops when the last body chunk is sent, so streamed responses are
+    timed until the client has received them, not just their headers.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        token = request_started_at.set(start)
+        finished = False
+
+        def observe():
+            route = scope.get("route")
+            request_seconds.observe(time.perf_counter() - start, route=route.path if route else "unmatched")
+
+        async def send_and_time(message):
+            nonlocal finished
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False) and not finished:
+                finished = True
+                observe()
+
+        try:
+            await self.app(scope, receive, send_and_time)
+        finally:
+            # Errors and client disconnects end the request without a final body chunk
+            if not finished:
+                observe()
+            request_started_at.reset(token)
+
+
+def observe_request_parse():
+    """Record the time between the request arriving and the handler starting."""
+    started_at = request_started_at.get()
+    if started_at is not None:
+        stage_seconds.observe(time.perf_counter() - started_at, stage="request_parse")
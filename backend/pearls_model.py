@@ -1,9 +1,15 @@
-from enum import Enum
-from typing import Dict, List
-import requests
+from typing import AsyncIterator, Dict, List, Tuple
 import os
+import time
 from dotenv import load_dotenv
 import logging
+from llm_client import AsyncLLMClient
+from context_manager import ContextManager, ContextStats, estimate_tokens
+from booklet_index import BookletRegistry
+from response_cache import ResponseCache
+from upstream_router import PhaseRoutes, UpstreamRouter
+from phases import PEARLSPhase
+import metrics
 
 # Load environment variables
 load_dotenv()
@@ -22,14 +28,6 @@ if not TOGETHERAI_API_KEY:
 
 logger.info("Environment variables loaded successfully")
 
-class PEARLSPhase(Enum):
-    PREPARATION = "P"
-    ENGAGEMENT = "E"
-    ANALYSIS = "A"
-    REFLECTION = "R"
-    LEARNING = "L"
-    SUMMARY = "S"
-
 class PEARLSModel:
     PHASE_PROMPTS = {
         PEARLSPhase.PREPARATION: """
@@ -99,6 +97,12 @@ class PEARLSModel:
         """
     }
 
+    BATCH_FEEDBACK_REQUEST = (
+        "The debriefing above has ended. Write a concise summary of the key points discussed, "
+        "followed by specific feedback for the learner: behaviors to sustain, areas to improve, "
+        "and one or two goals for future practice."
+    )
+
     PHASE_TRANSITIONS = {
         PEARLSPhase.PREPARATION: PEARLSPhase.ENGAGEMENT,
         PEARLSPhase.ENGAGEMENT: PEARLSPhase.ANALYSIS,
@@ -115,6 +119,15 @@ class PEARLSModel:
         logger.info("PEARLSModel initialized with Together AI API.")
         self.current_phase = PEARLSPhase.PREPARATION
         self.messages = []
+        self.llm_client = AsyncLLMClient(TOGETHERAI_API_KEY)
+        self.router = UpstreamRouter(self.llm_client)
+        self.phase_routes = PhaseRoutes()
+        self.context_manager = ContextManager()
+        self.booklets = BookletRegistry()
+        self.response_cache = ResponseCache()
+
+    async def aclose(self):
+        await self.llm_client.aclose()
 
     @staticmethod
     def get_phase_prompt(phase: PEARLSPhase) -> str:
@@ -133,8 +146,8 @@ class PEARLSModel:
         if current_phase == PEARLSPhase.SUMMARY:
             return False
 
-        # Count messages in current phase
-        phase_messages = [msg for msg in messages if msg.get("phase") == current_phase.value]
+        # Count learner turns in the current phase; each one is stored with the assistant reply to it
+        phase_messages = [msg for msg in messages if msg.get("phase") == current_phase.value and msg.get("role") == "user"]
         
         # Transition after a minimum number of exchanges
         min_exchanges = {
@@ -148,68 +161,189 @@ class PEARLSModel:
 
         return len(phase_messages) >= min_exchanges[current_phase]
 
-    def process_input(self, user_input: str, phase: str = "PREPARATION", conversation_history: List[Dict] = None, case_booklet_link: str = None) -> str:
-        logger.info(f"Processing input in {phase} phase")
-        system_message = self._get_system_message(phase)
-        if case_booklet_link:
-            system_message = f"Case Booklet Link: {case_booklet_link}\n" + system_message
-        conversation = []
-        if conversation_history and isinstance(conversation_history, list):
-            conversation = conversation_history.copy()
-        conversation.insert(0, {"role": "system", "content": system_message})
-        url = "https://api.together.xyz/v1/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {TOGETHERAI_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        payload = {
-            "model": "mistralai/Mixtral-8x7B-Instruct-v0.1",
+    async def aprocess_input(self, user_input: str, phase: str = "PREPARATION", conversation_history: List[Dict] = None, case_booklet_link: str = None) -> str:
+        """
+        Stateless turn: the caller owns the transcript and passes it in as
+        conversation_history. The server does not know which phase the
+        transcript is in, so the turn uses the default route and is never
+        served from the response cache.
+        """
+        logger.info("Processing input in %s phase", phase)
+        try:
+            passages = await self._booklet_passages(case_booklet_link, user_input) if case_booklet_link else None
+            payload, _ = self._build_payload(phase, conversation_history, case_booklet_link, passages=passages,
+                                             route=self.phase_routes.default())
+            return self._finalize_response(await self._complete(phase, payload, cacheable=False))
+        except Exception as e:
+            metrics.errors.inc(phase=phase)
+            logger.error("Error in aprocess_input: %s", e)
+            raise
+
+    def _build_payload(self, phase: str, conversation_history: List[Dict] = None, case_booklet_link: str = None,
+                       summaries: Dict[str, str] = None, passages: List[str] = None, route: Dict = None) -> Tuple[Dict, ContextStats]:
+        with metrics.stage_seconds.time(stage="prompt_assembly"):
+            system_message = self._get_system_message(phase)
+            if passages:
+                excerpts = "\n".join(f"[{i}] {passage}" for i, passage in enumerate(passages, 1))
+                system_message = f"Relevant case booklet excerpts:\n{excerpts}\n" + system_message
+            if case_booklet_link:
+                system_message = f"Case Booklet Link: {case_booklet_link}\n" + system_message
+            history = conversation_history if isinstance(conversation_history, list) else []
+            conversation, stats = self.context_manager.assemble(system_message, history, summaries)
+        metrics.tokens_saved.inc(stats.tokens_saved, phase=phase)
+        route = route or self.phase_routes.route(phase)
+        return {
+            "model": route["model"],
             "messages": conversation,
             "temperature": 0.7,
-            "max_tokens": 500
-        }
-        logger.info(f"Sending request to Together AI API:")
-        logger.info(f"URL: {url}")
-        logger.info(f"Headers: {headers}")
-        logger.info(f"Payload: {payload}")
+            "max_tokens": route["max_tokens"]
+        }, stats
+
+    async def aprocess_turn(self, session, user_input: str) -> str:
+        """
+        Process one learner utterance against a server-side session.
+        Phase and transcript come from the session rather than the request,
+        and are only updated once the upstream call has succeeded.
+        """
+        phase = session.phase
+        logger.info("Processing session %s input in %s phase", session.session_id, phase.name)
         try:
-            response = requests.post(url, headers=headers, json=payload)
-            if response.status_code != 200:
-                logger.error(f"Together AI API error: Status {response.status_code}")
-                logger.error(f"Response headers: {dict(response.headers)}")
-                logger.error(f"Response body: {response.text}")
-                response.raise_for_status()
-            data = response.json()
-            logger.info(f"Together AI API response: {data}")
-            assistant_response = data["choices"][0]["message"]["content"]
-
-            # Check if we should transition to the next phase
-            if self.should_transition_phase(self.messages, self.current_phase):
-                next_phase = self.get_next_phase(self.current_phase)
-                if next_phase:
-                    self.current_phase = next_phase
-                    # Add a phase transition message
-                    transition_message = f"\n\nWe're now moving to the {next_phase.name.title()} phase of our debriefing."
-                    assistant_response += transition_message
-
-            return assistant_response
+            messages = session.messages + [{"role": "user", "content": user_input, "phase": phase.value}]
+            passages = await self._session_passages(session, user_input)
+            payload, session.context_stats = self._build_payload(phase.name, messages, session.case_booklet_link, session.summaries, passages)
+            assistant_response = await self._complete(phase.name, payload)
+        except Exception as e:
+            metrics.errors.inc(phase=phase.name)
+            logger.error("Error in aprocess_turn: %s", e)
+            raise
+        return assistant_response + self._complete_turn(session, messages, assistant_response)
 
+    async def astream_turn(self, session, user_input: str) -> AsyncIterator[str]:
+        """
+        Streaming variant of aprocess_turn. Yields completion tokens as they
+        arrive and the phase-transition suffix, if any, as the final chunk.
+        The session is only updated once the stream has completed.
+        """
+        phase = session.phase
+        logger.info("Streaming session %s input in %s phase", session.session_id, phase.name)
+        messages = session.messages + [{"role": "user", "content": user_input, "phase": phase.value}]
+        passages = await self._session_passages(session, user_input)
+        payload, session.context_stats = self._build_payload(phase.name, messages, session.case_booklet_link, session.summaries, passages)
+        cache_key = self.response_cache.make_key(phase.name, payload)
+        cached = await self.response_cache.get(cache_key) if cache_key else None
+        tokens = [cached] if cached is not None else []
+        if cached is not None:
+            yield cached
+        else:
+            start = time.perf_counter()
+            try:
+                async for token in self.router.stream_chat_completion(payload):
+                    if not tokens:
+                        logger.info("Time to first token: %.0f ms", (time.perf_counter() - start) * 1000)
+                    tokens.append(token)
+                    yield token
+            except Exception as e:
+                metrics.errors.inc(phase=phase.name)
+                logger.error("Error in astream_turn: %s", e)
+                raise
+            elapsed = time.perf_counter() - start
+            metrics.stage_seconds.observe(elapsed, stage="upstream_wait")
+            metrics.prompt_tokens.inc(session.context_stats.tokens_out, phase=phase.name)
+            metrics.completion_tokens.inc(estimate_tokens("".join(tokens)), phase=phase.name)
+            if cache_key:
+                self.response_cache.record_miss(elapsed)
+                await self.response_cache.put(cache_key, "".join(tokens))
+        transition_message = self._complete_turn(session, messages, "".join(tokens))
+        if transition_message:
+            yield transition_message
+
+    async def asummarize_transcript(self, transcript: List, case_booklet_link: str = None) -> Tuple[str, ContextStats]:
+        """
+        Produce summary feedback for a recorded debrief in a single upstream
+        call. `transcript` holds {"role", "content"} messages; bare strings
+        are treated as learner utterances.
+        """
+        messages = [
+            {"role": "user", "content": msg} if isinstance(msg, str) else {"role": msg["role"], "content": msg["content"]}
+            for msg in transcript
+        ]
+        messages.append({"role": "user", "content": self.BATCH_FEEDBACK_REQUEST})
+        try:
+            passages = None
+            if case_booklet_link:
+                learner_text = " ".join(msg["content"] for msg in messages if msg["role"] == "user")
+                passages = await self._booklet_passages(case_booklet_link, learner_text[:2000])
+            payload, stats = self._build_payload(PEARLSPhase.SUMMARY.name, messages, case_booklet_link, passages=passages)
+            return await self._complete(PEARLSPhase.SUMMARY.name, payload), stats
         except Exception as e:
-            logger.error(f"Error in process_input: {e}")
+            metrics.errors.inc(phase=PEARLSPhase.SUMMARY.name)
+            logger.error("Error in asummarize_transcript: %s", e)
             raise
 
+    async def _complete(self, phase: str, payload: Dict, cacheable: bool = True) -> str:
+        """Upstream completion text, served from the response cache when the phase allows it."""
+        async def fetch() -> str:
+            with metrics.stage_seconds.time(stage="upstream_wait"):
+                data = await self.router.chat_completion(payload)
+            self._record_usage(phase, payload, data)
+            return data["choices"][0]["message"]["content"]
+
+        cache_key = self.response_cache.make_key(phase, payload) if cacheable else None
+        if cache_key is None:
+            return await fetch()
+        return await self.response_cache.get_or_compute(cache_key, fetch)
+
+    @staticmethod
+    def _record_usage(phase: str, payload: Dict, data: Dict):
+        usage = data.get("usage") or {}
+        prompt = usage.get("prompt_tokens") or sum(estimate_tokens(msg["content"]) for msg in payload["messages"])
+        completion = usage.get("completion_tokens") or estimate_tokens(data["choices"][0]["message"]["content"])
+        metrics.prompt_tokens.inc(prompt, phase=phase)
+        metrics.completion_tokens.inc(completion, phase=phase)
+
+    async def _booklet_passages(self, source: str, query: str) -> List[str]:
+        with metrics.stage_seconds.time(stage="booklet_retrieval"):
+            return await self.booklets.passages(source, query)
+
+    async def _session_passages(self, session, user_input: str) -> List[str]:
+        if not session.case_booklet_link:
+            return []
+        # The previous question gives context to short answers like "yes, twice"
+        last_reply = session.messages[-1]["content"] if session.messages else ""
+        return await self._booklet_passages(session.case_booklet_link, f"{user_input} {last_reply}")
+
+    def _complete_turn(self, session, messages: List[Dict], assistant_response: str) -> str:
+        """
+        Record the assistant reply on the session and advance its phase.
+        A phase that has just finished is compacted into a cached summary,
+        which stands in for its older turns once a prompt is over budget.
+        """
+        with metrics.stage_seconds.time(stage="phase_transition"):
+            phase = session.phase
+            messages.append({"role": "assistant", "content": assistant_response, "phase": phase.value})
+            session.messages = messages
+            session.phase, transition_message = self._advance_phase(messages, phase)
+            if session.phase != phase:
+                session.summaries[phase.value] = self.context_manager.summarize_phase(phase.name, phase.value, messages)
+        return transition_message
+
+    def _advance_phase(self, messages: List[Dict], current_phase: PEARLSPhase) -> Tuple[PEARLSPhase, str]:
+        # Check if we should transition to the next phase
+        if self.should_transition_phase(messages, current_phase):
+            next_phase = self.get_next_phase(current_phase)
+            if next_phase:
+                # Add a phase transition message
+                return next_phase, f"\n\nWe're now moving to the {next_phase.name.title()} phase of our debriefing."
+        return current_phase, ""
+
+    def _finalize_response(self, assistant_response: str) -> str:
+        with metrics.stage_seconds.time(stage="phase_transition"):
+            self.current_phase, transition_message = self._advance_phase(self.messages, self.current_phase)
+        return assistant_response + transition_message
+
     def _get_system_message(self, phase: str) -> str:
-        if phase == "PREPARATION":
-            return (
-                "\n        You are in the Preparation phase of the PEARLS debriefing model.\n"
-                "        Focus on:\n"
-                "        1. Setting the stage for learning\n"
-                "        2. Establishing psychological safety\n"
-                "        3. Clarifying learning objectives\n"
-                "        4. Reviewing the simulation scenario\n"
-                "        \n        Ask questions that help the learner prepare for the debriefing process.\n        "
-            )
-        # Add other phases as needed
+        if phase in PEARLSPhase.__members__:
+            return self.get_phase_prompt(PEARLSPhase[phase])
         return "You are a helpful assistant."
 
     def get_current_phase(self) -> PEARLSPhase:
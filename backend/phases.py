@@ -0,0 +1,10 @@
+from enum import Enum
+
+
+class PEARLSPhase(Enum):
+    PREPARATION = "P"
+    ENGAGEMENT = "E"
+    ANALYSIS = "A"
+    REFLECTION = "R"
+    LEARNING = "L"
+    SUMMARY = "S"
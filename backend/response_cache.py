@@ -0,0 +1,171 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s.!?,;:]+$")
+
+
+def normalize_text(text: str) -> str:
+    """Case, whitespace and trailing punctuation do not change the answer we want to reuse."""
+    return _TRAILING_PUNCTUATION.sub("", _WHITESPACE.sub(" ", text.strip().lower()))
+
+
+class ResponseCache:
+    """
+    Completion cache keyed on a normalized hash of the model, phase, system
+    messages (prompt, booklet excerpts, phase summaries) and the trailing
+    window of conversation turns. An in-memory LRU with TTL sits in front
+    of an optional on-disk tier, and concurrent misses for the same key
+    share one upstream call.
+    """
+
+    def __init__(self, max_entries: int = None, ttl_seconds: float = None, window: int = None,
+                 skip_phases: str = None, disk_dir: str = None):
+        self.max_entries = max_entries or int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2048"))
+        self.ttl_seconds = ttl_seconds or float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "86400"))
+        self.window = window or int(os.getenv("RESPONSE_CACHE_WINDOW", "2"))
+        skip_phases = skip_phases if skip_phases is not None else os.getenv("RESPONSE_CACHE_SKIP_PHASES", "REFLECTION,LEARNING,SUMMARY")
+        self.skip_phases = {phase.strip().upper() for phase in skip_phases.split(",") if phase.strip()}
+        self.disk_dir = disk_dir or os.getenv("RESPONSE_CACHE_DIR")
+        self.enabled = os.getenv("RESPONSE_CACHE_ENABLED", "1") != "0"
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.upstream_seconds = 0.0
+        self.saved_seconds = 0.0
+
+    def make_key(self, phase: str, payload: Dict) -> Optional[str]:
+        """Cache key for payload, or None when caching is off for this phase."""
+        if not self.enabled or phase.upper() in self.skip_phases:
+            return None
+        messages = payload["messages"]
+        system = [msg["content"] for msg in messages if msg["role"] == "system"]
+        turns = [msg for msg in messages if msg["role"] != "system"][-self.window:]
+        material = json.dumps({
+            "model": payload.get("model"),
+            "temperature": payload.get("temperature"),
+            "max_tokens": payload.get("max_tokens"),
+            "phase": phase.upper(),
+            "system": [normalize_text(content) for content in system],
+            "turns": [[msg["role"], normalize_text(msg["content"])] for msg in turns]
+        }, sort_keys=True)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def _get_memory(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at < time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _put_memory(self, key: str, value: str):
+        self._entries[key] = (value, time.time() + self.ttl_seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _get_disk(self, key: str) -> Optional[str]:
+        path = self._disk_path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                os.remove(path)
+                return None
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)["response"]
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("Ignoring unreadable response cache entry %s: %s", path, e)
+            return None
+
+    def _put_disk(self, key: str, value: str):
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"response": value}, f)
+        os.replace(tmp_path, path)
+
+    async def get(self, key: str) -> Optional[str]:
+        value = self._get_memory(key)
+        if value is None and self.disk_dir:
+            value = await asyncio.to_thread(self._get_disk, key)
+            if value is not None:
+                self._put_memory(key, value)
+        if value is not None:
+            self._record_hit()
+        return value
+
+    async def put(self, key: str, value: str):
+        self._put_memory(key, value)
+        if self.disk_dir:
+            await asyncio.to_thread(self._put_disk, key, value)
+
+    def _record_hit(self):
+        self.hits += 1
+        if self.misses:
+            self.saved_seconds += self.upstream_seconds / self.misses
+
+    def record_miss(self, upstream_seconds: float):
+        self.misses += 1
+        self.upstream_seconds += upstream_seconds
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[str]]) -> str:
+        value = await self.get(key)
+        if value is not None:
+            return value
+        task = self._pending.get(key)
+        if task is not None:
+            self.coalesced += 1
+            value = await asyncio.shield(task)
+            self._record_hit()
+            return value
+
+        # The upstream call runs in its own task so cancelling the request that
+        # started it does not cancel it for the requests coalesced onto it
+        task = asyncio.ensure_future(self._compute_and_store(key, compute))
+        self._pending[key] = task
+        task.add_done_callback(lambda done: self._finish_pending(key, done))
+        return await asyncio.shield(task)
+
+    async def _compute_and_store(self, key: str, compute: Callable[[], Awaitable[str]]) -> str:
+        start = time.perf_counter()
+        value = await compute()
+        self.record_miss(time.perf_counter() - start)
+        await self.put(key, value)
+        return value
+
+    def _finish_pending(self, key: str, task: asyncio.Future):
+        self._pending.pop(key, None)
+        if not task.cancelled():
+            # Mark the exception retrieved so a failure nobody waited for does not log a warning
+            task.exception()
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "latency_saved_seconds": round(self.saved_seconds, 3)
+        }
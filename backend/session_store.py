@@ -0,0 +1,248 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from phases import PEARLSPhase
+
+logger = logging.getLogger(__name__)
+
+
+class SessionConflictError(Exception):
+    """Raised when another worker saved the session after this worker loaded it."""
+
+
+class DebriefSession:
+    """Phase and transcript for a single learner's debrief."""
+
+    def __init__(self, session_id: str, phase: PEARLSPhase = PEARLSPhase.PREPARATION, messages: List[Dict] = None,
+                 case_booklet_link: str = None, summaries: Dict[str, str] = None, version: int = 0,
+                 updated_at: float = None):
+        self.session_id = session_id
+        self.phase = phase
+        self.messages = messages or []
+        self.case_booklet_link = case_booklet_link
+        # Cached per-phase summaries, keyed by PEARLSPhase value
+        self.summaries = summaries or {}
+        self.version = version
+        self.updated_at = updated_at or time.time()
+        # Serializes turns of the same session within this worker
+        self.lock = asyncio.Lock()
+        # Prompt assembly stats for the latest turn; not persisted
+        self.context_stats = None
+
+    def to_dict(self) -> Dict:
+        return {
+            "session_id": self.session_id,
+            "phase": self.phase.name,
+            "messages": self.messages,
+            "case_booklet_link": self.case_booklet_link,
+            "summaries": self.summaries,
+            "version": self.version,
+            "updated_at": self.updated_at
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "DebriefSession":
+        return cls(
+            session_id=data["session_id"],
+            phase=PEARLSPhase[data["phase"]],
+            messages=data.get("messages", []),
+            case_booklet_link=data.get("case_booklet_link"),
+            summaries=data.get("summaries"),
+            version=data.get("version", 0),
+            updated_at=data.get("updated_at")
+        )
+
+
+class SessionBackend:
+    """Persistent tier behind the in-memory store. Implementations must be thread-safe."""
+
+    def load(self, session_id: str) -> Optional[DebriefSession]:
+        raise NotImplementedError
+
+    def version(self, session_id: str) -> Optional[int]:
+        raise NotImplementedError
+
+    def save(self, session: DebriefSession, expected_version: Optional[int]) -> bool:
+        """
+        Write session if the stored copy is still at expected_version and
+        return False otherwise. expected_version=None writes unconditionally.
+        """
+        raise NotImplementedError
+
+    def delete(self, session_id: str):
+        raise NotImplementedError
+
+    def purge_expired(self, older_than: float):
+        raise NotImplementedError
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """Stores sessions in a SQLite file so several uvicorn workers can share them."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, data TEXT NOT NULL, version INTEGER NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def load(self, session_id: str) -> Optional[DebriefSession]:
+        row = self._connect().execute("SELECT data FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return DebriefSession.from_dict(json.loads(row[0])) if row else None
+
+    def version(self, session_id: str) -> Optional[int]:
+        row = self._connect().execute("SELECT version FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return row[0] if row else None
+
+    def save(self, session: DebriefSession, expected_version: Optional[int]) -> bool:
+        data = json.dumps(session.to_dict())
+        with self._connect() as conn:
+            if expected_version is None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO sessions (session_id, data, version, updated_at) VALUES (?, ?, ?, ?)",
+                    (session.session_id, data, session.version, session.updated_at)
+                )
+                return True
+            cursor = conn.execute(
+                "UPDATE sessions SET data = ?, version = ?, updated_at = ? WHERE session_id = ? AND version = ?",
+                (data, session.version, session.updated_at, session.session_id, expected_version)
+            )
+            return cursor.rowcount == 1
+
+    def delete(self, session_id: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def purge_expired(self, older_than: float):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM sessions WHERE updated_at < ?", (older_than,))
+
+
+class SessionStore:
+    """
+    Memory-bounded LRU of debrief sessions with TTL eviction.
+    When a backend is configured it is used write-through, and a cached
+    session is reloaded if another worker has saved a newer version.
+    """
+
+    PURGE_EVERY = 100
+
+    def __init__(self, max_sessions: int = 1000, ttl_seconds: float = 4 * 3600, backend: SessionBackend = None):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.backend = backend
+        self._sessions: "OrderedDict[str, DebriefSession]" = OrderedDict()
+        self._writes = 0
+
+    @classmethod
+    def from_env(cls) -> "SessionStore":
+        db_path = os.getenv("SESSION_DB_PATH")
+        return cls(
+            max_sessions=int(os.getenv("SESSION_MAX_ENTRIES", "1000")),
+            ttl_seconds=float(os.getenv("SESSION_TTL_SECONDS", str(4 * 3600))),
+            backend=SQLiteSessionBackend(db_path) if db_path else None
+        )
+
+    def _expired(self, session: DebriefSession) -> bool:
+        return time.time() - session.updated_at > self.ttl_seconds
+
+    def _remember(self, session: DebriefSession):
+        self._sessions[session.session_id] = session
+        self._sessions.move_to_end(session.session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    async def get(self, session_id: str) -> Optional[DebriefSession]:
+        session = self._sessions.get(session_id)
+        if session is not None and self.backend is None:
+            if self._expired(session):
+                self._sessions.pop(session_id, None)
+                return None
+            self._sessions.move_to_end(session_id)
+            return session
+        if session is not None and not self._expired(session):
+            latest = await asyncio.to_thread(self.backend.version, session_id)
+            if latest is not None and latest <= session.version:
+                self._sessions.move_to_end(session_id)
+                return session
+        if self.backend is None:
+            return None
+        # Another worker may have kept the session alive, so expiry is judged from the
+        # stored row; expired rows are left to purge_expired rather than deleted here
+        loaded = await asyncio.to_thread(self.backend.load, session_id)
+        if loaded is None or self._expired(loaded):
+            self._sessions.pop(session_id, None)
+            return None
+        if session is not None:
+            # Keep the in-process lock so queued turns stay serialized
+            loaded.lock = session.lock
+        self._remember(loaded)
+        return loaded
+
+    async def create(self, session_id: str = None, case_booklet_link: str = None) -> DebriefSession:
+        session = DebriefSession(session_id or uuid.uuid4().hex, case_booklet_link=case_booklet_link)
+        # A fresh session has nothing to lose, so it may replace an expired row with the same id
+        await self._write(session, expected_version=None)
+        return session
+
+    async def get_or_create(self, session_id: str = None, case_booklet_link: str = None) -> DebriefSession:
+        session = await self.get(session_id) if session_id else None
+        if session is None:
+            session = await self.create(session_id, case_booklet_link)
+        return session
+
+    async def save(self, session: DebriefSession):
+        """
+        Persist a finished turn. If another worker saved the session first,
+        the cached copy is replaced by the stored one and
+        SessionConflictError is raised so the caller can redo the turn.
+        """
+        await self._write(session, expected_version=session.version)
+
+    async def _write(self, session: DebriefSession, expected_version: Optional[int]):
+        session.version += 1
+        session.updated_at = time.time()
+        if self.backend is not None:
+            saved = await asyncio.to_thread(self.backend.save, session, expected_version)
+            if not saved:
+                await self._reload(session)
+                raise SessionConflictError(f"Session {session.session_id} was updated by another request")
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                await asyncio.to_thread(self.backend.purge_expired, time.time() - self.ttl_seconds)
+        self._remember(session)
+
+    async def _reload(self, stale: DebriefSession):
+        loaded = await asyncio.to_thread(self.backend.load, stale.session_id)
+        if loaded is None:
+            self._sessions.pop(stale.session_id, None)
+            return
+        loaded.lock = stale.lock
+        self._remember(loaded)
+
+    async def delete(self, session_id: str):
+        self._sessions.pop(session_id, None)
+        if self.backend is not None:
+            await asyncio.to_thread(self.backend.delete, session_id)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
@@ -0,0 +1,408 @@
+"""
+Server-side text-to-speech.
+
+Assistant replies are split into sentences as tokens stream in, and each
+sentence is synthesized on a worker pool as soon as it is complete, so the
+first sentence can play while the rest of the reply is still being
+generated. Audio is stored in a content-addressed cache keyed by the
+engine, voice settings and text, so recurring lines such as the phase
+transitions are synthesized once.
+"""
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import math
+import os
+import re
+import struct
+import time
+import wave
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+# Sentence-ending punctuation (optionally closed by quotes or brackets) followed by whitespace
+_SENTENCE_END = re.compile(r"[.!?]+[\"')\]]*(?=\s)|\n\s*\n")
+_ABBREVIATIONS = {"dr", "mr", "mrs", "ms", "vs", "e.g", "i.e", "etc", "approx"}
+
+# Voice settings come from the request body and gTTS builds its request URL from
+# them, so only these values are accepted
+LANGUAGES = {"en", "es", "fr", "de", "it", "pt", "nl", "zh-CN", "ja", "ko", "ar", "hi"}
+ACCENTS = {"com", "co.uk", "com.au", "ca", "co.in", "ie", "co.za", "com.br", "pt", "es", "com.mx", "fr"}
+MIN_RATE = 0.25
+MAX_RATE = 4.0
+
+
+class VoiceSettings:
+    """Voice parameters that change the synthesized audio, and so are part of its cache key."""
+
+    def __init__(self, language: str = "en", accent: str = "com", rate: float = 1.0):
+        self.language = language
+        self.accent = accent
+        self.rate = rate
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict]) -> "VoiceSettings":
+        """Validated settings from a request body; raises ValueError for unsupported values."""
+        data = data or {}
+        language = data.get("language", "en")
+        accent = data.get("accent", "com")
+        if language not in LANGUAGES:
+            raise ValueError(f"Unsupported voice language {language!r}; expected one of {', '.join(sorted(LANGUAGES))}")
+        if accent not in ACCENTS:
+            raise ValueError(f"Unsupported voice accent {accent!r}; expected one of {', '.join(sorted(ACCENTS))}")
+        try:
+            rate = float(data.get("rate", 1.0))
+        except (TypeError, ValueError):
+            raise ValueError(f"Voice rate must be a number, got {data.get('rate')!r}")
+        if not MIN_RATE <= rate <= MAX_RATE:
+            raise ValueError(f"Voice rate must be between {MIN_RATE} and {MAX_RATE}")
+        return cls(language=language, accent=accent, rate=rate)
+
+    def to_dict(self) -> Dict:
+        return {"language": self.language, "accent": self.accent, "rate": self.rate}
+
+
+class TTSEngine:
+    """Engines turn one chunk of text into audio bytes. synthesize() blocks and runs on the worker pool."""
+
+    name = "base"
+    media_type = "application/octet-stream"
+
+    def synthesize(self, text: str, voice: VoiceSettings) -> bytes:
+        raise NotImplementedError
+
+
+class GTTSEngine(TTSEngine):
+    """Google Translate TTS via gTTS; needs network access and returns MP3."""
+
+    name = "gtts"
+    media_type = "audio/mpeg"
+
+    def __init__(self):
+        from gtts import gTTS
+        self._gtts = gTTS
+
+    def synthesize(self, text: str, voice: VoiceSettings) -> bytes:
+        buffer = io.BytesIO()
+        # gTTS has no rate control beyond its slow mode
+        self._gtts(text, lang=voice.language, tld=voice.accent, slow=voice.rate < 0.8).write_to_fp(buffer)
+        return buffer.getvalue()
+
+
+class OfflineEngine(TTSEngine):
+    """
+    Deterministic tone per chunk for tests and benchmarks: a 16 kHz WAV whose
+    length follows the text length and speaking rate. `seconds_per_char`
+    adds synthesis time proportional to the text, like a real engine.
+    """
+
+    name = "offline"
+    media_type = "audio/wav"
+    sample_rate = 16000
+
+    def __init__(self, seconds_per_char: float = 0.0):
+        self.seconds_per_char = seconds_per_char
+
+    def synthesize(self, text: str, voice: VoiceSettings) -> bytes:
+        if self.seconds_per_char:
+            time.sleep(self.seconds_per_char * len(text))
+        duration = max(0.2, 0.06 * len(text) / max(voice.rate, 0.1))
+        frequency = 220 + int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:4], 16) % 440
+        samples = int(self.sample_rate * duration)
+        frames = b"".join(
+            struct.pack("<h", int(8000 * math.sin(2 * math.pi * frequency * i / self.sample_rate)))
+            for i in range(samples)
+        )
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as out:
+            out.setnchannels(1)
+            out.setsampwidth(2)
+            out.setframerate(self.sample_rate)
+            out.writeframes(frames)
+        return buffer.getvalue()
+
+
+ENGINES = {
+    GTTSEngine.name: GTTSEngine,
+    OfflineEngine.name: OfflineEngine,
+}
+
+
+def create_engine(name: str = None) -> TTSEngine:
+    name = (name or os.getenv("TTS_ENGINE", "gtts")).lower()
+    if name not in ENGINES:
+        raise ValueError(f"Unknown TTS engine '{name}'; expected one of {', '.join(sorted(ENGINES))}")
+    return ENGINES[name]()
+
+
+class SentenceSplitter:
+    """
+    Accumulates streamed tokens and releases complete sentences. A boundary
+    is only accepted once the whitespace after it has arrived, so "3." in
+    "3.5 mg" or the "Dr." in "Dr. Lee" do not end a sentence.
+    """
+
+    def __init__(self, min_chars: int = 12):
+        self.min_chars = min_chars
+        self._buffer = ""
+
+    def feed(self, token: str) -> List[str]:
+        self._buffer += token
+        sentences = []
+        start = 0
+        for match in _SENTENCE_END.finditer(self._buffer):
+            end = match.end()
+            candidate = self._buffer[start:end].strip()
+            words = candidate.rstrip(".!?\"')]").split()
+            if not words or words[-1].lower() in _ABBREVIATIONS or len(candidate) < self.min_chars:
+                continue
+            sentences.append(candidate)
+            start = end
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self) -> List[str]:
+        rest, self._buffer = self._buffer.strip(), ""
+        return [rest] if rest else []
+
+
+class AudioCache:
+    """
+    Content-addressed audio store: an in-memory LRU bounded by total bytes,
+    in front of an optional on-disk tier (TTS_CACHE_DIR) with its own byte
+    budget that evicts the least recently used files first.
+    """
+
+    def __init__(self, max_bytes: int = None, disk_dir: str = None, disk_max_bytes: int = None):
+        self.max_bytes = max_bytes or int(os.getenv("TTS_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+        self.disk_dir = disk_dir or os.getenv("TTS_CACHE_DIR")
+        self.disk_max_bytes = disk_max_bytes or int(os.getenv("TTS_CACHE_DISK_MAX_BYTES", str(512 * 1024 * 1024)))
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._bytes = 0
+        self._disk_entries: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        if self.disk_dir:
+            self._scan_disk()
+
+    @staticmethod
+    def make_key(engine: TTSEngine, text: str, voice: VoiceSettings) -> str:
+        material = json.dumps({
+            "engine": engine.name,
+            "voice": voice.to_dict(),
+            "text": _WHITESPACE.sub(" ", text.strip())
+        }, sort_keys=True)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.audio")
+
+    def _scan_disk(self):
+        files = []
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                if name.endswith(".audio"):
+                    stat = os.stat(os.path.join(root, name))
+                    files.append((stat.st_mtime, name[:-len(".audio")], stat.st_size))
+        for _, key, size in sorted(files):
+            self._disk_entries[key] = size
+            self._disk_bytes += size
+
+    def _get_disk(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._disk_path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            self._disk_entries.pop(key, None)
+            return None
+
+    def _put_disk(self, key: str, audio: bytes):
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(audio)
+        os.replace(tmp_path, path)
+
+    def _evict_disk(self, keys: List[str]):
+        for key in keys:
+            try:
+                os.remove(self._disk_path(key))
+            except FileNotFoundError:
+                pass
+
+    def _put_memory(self, key: str, audio: bytes):
+        if len(audio) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._bytes -= len(self._entries.pop(key))
+        self._entries[key] = audio
+        self._bytes += len(audio)
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        audio = self._entries.get(key)
+        if audio is not None:
+            self._entries.move_to_end(key)
+        elif key in self._disk_entries:
+            audio = await asyncio.to_thread(self._get_disk, key)
+            if audio is not None:
+                self._disk_entries.move_to_end(key)
+                self._put_memory(key, audio)
+        if audio is not None:
+            self.hits += 1
+        return audio
+
+    async def put(self, key: str, audio: bytes):
+        self._put_memory(key, audio)
+        if not self.disk_dir or key in self._disk_entries:
+            return
+        await asyncio.to_thread(self._put_disk, key, audio)
+        self._disk_entries[key] = len(audio)
+        self._disk_bytes += len(audio)
+        evicted = []
+        while self._disk_bytes > self.disk_max_bytes and len(self._disk_entries) > 1:
+            old_key, size = self._disk_entries.popitem(last=False)
+            self._disk_bytes -= size
+            evicted.append(old_key)
+        if evicted:
+            await asyncio.to_thread(self._evict_disk, evicted)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "disk_entries": len(self._disk_entries),
+            "disk_bytes": self._disk_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+class SpeechChunk:
+    def __init__(self, index: int, text: str, audio: bytes, media_type: str):
+        self.index = index
+        self.text = text
+        self.audio = audio
+        self.media_type = media_type
+
+
+class SpeechPipeline:
+    """Synthesizes sentence chunks on a bounded worker pool, coalescing concurrent requests for the same audio."""
+
+    def __init__(self, engine: TTSEngine = None, cache: AudioCache = None, workers: int = None):
+        self.engine = engine or create_engine()
+        self.cache = cache or AudioCache()
+        self.workers = workers or int(os.getenv("TTS_WORKERS", "4"))
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="tts")
+        self._pending: Dict[str, asyncio.Task] = {}
+
+    async def synthesize(self, text: str, voice: VoiceSettings = None) -> Tuple[bytes, str]:
+        """Audio for text and its cache key."""
+        voice = voice or VoiceSettings()
+        key = self.cache.make_key(self.engine, text, voice)
+        audio = await self.cache.get(key)
+        if audio is not None:
+            return audio, key
+        task = self._pending.get(key)
+        if task is not None:
+            self.cache.hits += 1
+            return await asyncio.shield(task), key
+
+        self.cache.misses += 1
+        # Own task, so a listener who disconnects does not cancel audio other sessions are waiting for
+        task = asyncio.ensure_future(self._synthesize_and_store(key, text, voice))
+        self._pending[key] = task
+        task.add_done_callback(lambda done: self._finish_pending(key, done))
+        return await asyncio.shield(task), key
+
+    async def _synthesize_and_store(self, key: str, text: str, voice: VoiceSettings) -> bytes:
+        with metrics.stage_seconds.time(stage="tts_synthesis"):
+            audio = await asyncio.get_running_loop().run_in_executor(self._executor, self.engine.synthesize, text, voice)
+        await self.cache.put(key, audio)
+        return audio
+
+    def _finish_pending(self, key: str, task: asyncio.Future):
+        self._pending.pop(key, None)
+        if not task.cancelled():
+            task.exception()
+
+    async def speak(self, tokens: AsyncIterator[str], voice: VoiceSettings = None) -> AsyncIterator[Tuple[str, object]]:
+        """
+        Pass a token stream through, yielding ("token", str) as each token
+        arrives and ("audio", SpeechChunk) for each sentence in order. A
+        sentence starts synthesizing as soon as it is complete, so later
+        sentences are synthesized while earlier ones play. A sentence that
+        fails to synthesize is logged and skipped; the text is unaffected.
+        """
+        voice = voice or VoiceSettings()
+        events: asyncio.Queue = asyncio.Queue()
+        sentences: asyncio.Queue = asyncio.Queue()
+        synth_tasks = []
+
+        def submit(sentence: str):
+            task = asyncio.ensure_future(self.synthesize(sentence, voice))
+            synth_tasks.append(task)
+            sentences.put_nowait((sentence, task))
+
+        async def read_tokens():
+            splitter = SentenceSplitter()
+            try:
+                async for token in tokens:
+                    await events.put(("token", token))
+                    for sentence in splitter.feed(token):
+                        submit(sentence)
+                for sentence in splitter.flush():
+                    submit(sentence)
+            finally:
+                sentences.put_nowait(None)
+
+        async def emit_audio():
+            index = 0
+            while True:
+                item = await sentences.get()
+                if item is None:
+                    return
+                sentence, task = item
+                try:
+                    audio, _ = await task
+                except Exception as e:
+                    logger.warning("Skipping speech for a sentence that failed to synthesize: %s", e)
+                    continue
+                await events.put(("audio", SpeechChunk(index, sentence, audio, self.engine.media_type)))
+                index += 1
+
+        async def run_all():
+            try:
+                await asyncio.gather(read_tokens(), emit_audio())
+            finally:
+                await events.put(None)
+
+        runner = asyncio.ensure_future(run_all())
+        try:
+            while True:
+                event = await events.get()
+                if event is None:
+                    break
+                yield event
+            await runner
+        finally:
+            runner.cancel()
+            for task in synth_tasks:
+                task.cancel()
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,302 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+from typing import AsyncIterator, Dict, Optional
+
+import httpx
+
+import metrics
+from llm_client import AsyncLLMClient
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "mistralai/Mixtral-8x7B-Instruct-v0.1"
+DEFAULT_MAX_TOKENS = 500
+
+# Preparation is short scene-setting, so a smaller model answers it faster
+DEFAULT_PHASE_ROUTES = {
+    "PREPARATION": {"model": "mistralai/Mistral-7B-Instruct-v0.2", "max_tokens": 300},
+}
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling upstream while the circuit breaker for a model is open."""
+
+
+class PhaseRoutes:
+    """
+    Model and max_tokens per PEARLS phase. PHASE_MODEL_ROUTES may hold a JSON
+    object such as {"SUMMARY": {"model": "...", "max_tokens": 700}} to
+    override or extend the defaults; unlisted phases use DEFAULT_MODEL.
+    """
+
+    def __init__(self, routes: Dict[str, Dict] = None):
+        if routes is None:
+            routes = dict(DEFAULT_PHASE_ROUTES)
+            routes.update(json.loads(os.getenv("PHASE_MODEL_ROUTES", "{}")))
+        self.routes = {phase.upper(): route for phase, route in routes.items()}
+
+    def route(self, phase: str) -> Dict:
+        route = self.routes.get(phase.upper(), {})
+        default = self.default()
+        return {
+            "model": route.get("model", default["model"]),
+            "max_tokens": route.get("max_tokens", default["max_tokens"])
+        }
+
+    @staticmethod
+    def default() -> Dict:
+        """Route for requests with no PEARLS phase of their own, such as stateless turns."""
+        return {"model": DEFAULT_MODEL, "max_tokens": DEFAULT_MAX_TOKENS}
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures and lets one trial request through after `reset_after` seconds."""
+
+    def __init__(self, threshold: int, reset_after: float):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.reset_after else "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def release_trial(self):
+        self._trial_in_flight = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self, trial: bool = False):
+        self.failures += 1
+        if trial or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+        if trial:
+            self._trial_in_flight = False
+
+
+def is_outage(error: Exception) -> bool:
+    """Errors that say upstream is unhealthy and count toward opening the breaker."""
+    if isinstance(error, (httpx.TransportError, asyncio.TimeoutError)):
+        return True
+    return isinstance(error, httpx.HTTPStatusError) and error.response.status_code >= 500
+
+
+def is_retryable(error: Exception) -> bool:
+    if is_outage(error):
+        return True
+    return isinstance(error, httpx.HTTPStatusError) and error.response.status_code == 429
+
+
+class UpstreamRouter:
+    """
+    Tail-latency controls in front of AsyncLLMClient: deadline-aware retries
+    with full-jitter backoff, a per-model circuit breaker, and optional
+    hedging that fires a second attempt once the first has taken longer than
+    the recent p95 for that model, keeping whichever answers first.
+    """
+
+    def __init__(self, client: AsyncLLMClient, deadline: float = None, attempt_timeout: float = None, max_attempts: int = None,
+                 backoff_base: float = None, backoff_cap: float = None, hedge: bool = None,
+                 breaker_threshold: int = None, breaker_reset_after: float = None):
+        self.client = client
+        self.deadline = deadline or float(os.getenv("UPSTREAM_DEADLINE_SECONDS", "45"))
+        # A stalled attempt is abandoned after this long so a retry still fits in the deadline
+        self.attempt_timeout = attempt_timeout or float(os.getenv("UPSTREAM_ATTEMPT_TIMEOUT_SECONDS", "20"))
+        self.max_attempts = max_attempts or int(os.getenv("UPSTREAM_MAX_ATTEMPTS", "3"))
+        self.backoff_base = backoff_base or float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.25"))
+        self.backoff_cap = backoff_cap or float(os.getenv("UPSTREAM_BACKOFF_CAP", "4"))
+        self.hedge = hedge if hedge is not None else os.getenv("UPSTREAM_HEDGE", "0") == "1"
+        self.hedge_min_samples = 20
+        self.breaker_threshold = breaker_threshold or int(os.getenv("UPSTREAM_BREAKER_THRESHOLD", "5"))
+        self.breaker_reset_after = breaker_reset_after or float(os.getenv("UPSTREAM_BREAKER_RESET_SECONDS", "30"))
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._latencies: Dict[str, deque] = {}
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        if model not in self._breakers:
+            self._breakers[model] = CircuitBreaker(self.breaker_threshold, self.breaker_reset_after)
+        return self._breakers[model]
+
+    def hedge_delay(self, model: str) -> Optional[float]:
+        samples = self._latencies.get(model)
+        if not self.hedge or samples is None or len(samples) < self.hedge_min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def _record_latency(self, model: str, seconds: float):
+        self._latencies.setdefault(model, deque(maxlen=200)).append(seconds)
+
+    def _backoff(self, attempt: int, error: Exception = None) -> float:
+        backoff = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+        if isinstance(error, httpx.HTTPStatusError) and error.response.status_code == 429:
+            # Honour the upstream rate limiter rather than hammering it again
+            try:
+                backoff = max(backoff, float(error.response.headers.get("retry-after", 0)))
+            except ValueError:
+                pass
+        return backoff
+
+    @staticmethod
+    def _record_error(breaker: CircuitBreaker, error: Exception, trial: bool):
+        if is_outage(error):
+            breaker.record_failure(trial)
+        elif isinstance(error, httpx.HTTPStatusError) and error.response.status_code != 429:
+            # Upstream answered; a 4xx says the request was bad, not that the service is down
+            breaker.record_success()
+        # A 429 is backed off and retried without counting against the breaker, so a
+        # rate-limited batch cannot open the circuit for live sessions
+
+    def _attempt_timeout(self, model: str, deadline: float) -> float:
+        timeout = min(self.attempt_timeout, deadline - time.monotonic())
+        if timeout <= 0:
+            # Raised before the breaker is consulted: a local queue is not an upstream outage
+            raise asyncio.TimeoutError(f"Deadline passed while waiting for an upstream slot for {model}")
+        return timeout
+
+    async def _attempt(self, payload: Dict, deadline: float, started: asyncio.Event = None) -> Dict:
+        model = payload["model"]
+        breaker = self.breaker(model)
+        # The attempt timeout, latency sample and breaker only cover the upstream call,
+        # not time spent queued for one of the client's concurrency slots
+        async with self.client.slot():
+            timeout = self._attempt_timeout(model, deadline)
+            trial = breaker.state == "half_open"
+            if not breaker.allow():
+                raise CircuitOpenError(f"Circuit open for {model}")
+            if started is not None:
+                started.set()
+            start = time.perf_counter()
+            try:
+                data = await asyncio.wait_for(self.client.post_completion(payload), timeout)
+            except Exception as e:
+                self._record_error(breaker, e, trial)
+                raise
+            finally:
+                # Covers cancelled hedge losers and errors that leave the breaker as it was
+                if trial:
+                    breaker.release_trial()
+            breaker.record_success()
+            self._record_latency(model, time.perf_counter() - start)
+        return data
+
+    async def _hedged_attempt(self, payload: Dict, deadline: float) -> Dict:
+        delay = self.hedge_delay(payload["model"])
+        if delay is None or delay >= min(self.attempt_timeout, deadline - time.monotonic()):
+            return await self._attempt(payload, deadline)
+        started = asyncio.Event()
+        first = asyncio.ensure_future(self._attempt(payload, deadline, started))
+        tasks = {first}
+        try:
+            # The hedge delay counts from when the first attempt reaches upstream, so
+            # requests queued for a slot are not duplicated into the same queue
+            waiter = asyncio.ensure_future(started.wait())
+            try:
+                await asyncio.wait({first, waiter}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                waiter.cancel()
+            if not first.done():
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done:
+                    metrics.upstream_hedges.inc(model=payload["model"])
+                    tasks.add(asyncio.ensure_future(self._attempt(payload, deadline)))
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def chat_completion(self, payload: Dict) -> Dict:
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            try:
+                return await self._hedged_attempt(payload, deadline)
+            except Exception as e:
+                attempt += 1
+                backoff = self._backoff(attempt, e)
+                remaining = deadline - time.monotonic()
+                if not is_retryable(e) or attempt >= self.max_attempts or remaining <= backoff:
+                    raise
+                metrics.upstream_retries.inc(model=payload["model"])
+                logger.warning("Retrying upstream call (attempt %d) after %s: %s", attempt + 1, type(e).__name__, e)
+                await asyncio.sleep(backoff)
+
+    async def stream_chat_completion(self, payload: Dict) -> AsyncIterator[str]:
+        """
+        Streams are retried only until the first token arrives; after that
+        a failure is surfaced, since tokens have already reached the learner.
+        The concurrency slot is held for the whole stream but released
+        while backing off between attempts.
+        """
+        model = payload["model"]
+        breaker = self.breaker(model)
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            async with self.client.slot():
+                timeout = self._attempt_timeout(model, deadline)
+                trial = breaker.state == "half_open"
+                if not breaker.allow():
+                    raise CircuitOpenError(f"Circuit open for {model}")
+                stream = self.client.stream_completion(payload)
+                try:
+                    first = await asyncio.wait_for(stream.__anext__(), timeout)
+                except StopAsyncIteration:
+                    breaker.record_success()
+                    return
+                except BaseException as e:
+                    if isinstance(e, Exception):
+                        self._record_error(breaker, e, trial)
+                    if trial:
+                        breaker.release_trial()
+                    await stream.aclose()
+                    if not isinstance(e, Exception):
+                        raise
+                    error = e
+                else:
+                    breaker.record_success()
+                    try:
+                        yield first
+                        async for token in stream:
+                            yield token
+                    finally:
+                        await stream.aclose()
+                    return
+            attempt += 1
+            backoff = self._backoff(attempt, error)
+            if not is_retryable(error) or attempt >= self.max_attempts or deadline - time.monotonic() <= backoff:
+                raise error
+            metrics.upstream_retries.inc(model=model)
+            logger.warning("Retrying upstream stream (attempt %d) after %s: %s", attempt + 1, type(error).__name__, error)
+            await asyncio.sleep(backoff)
+
+    def breaker_states(self) -> Dict[str, str]:
+        return {model: breaker.state for model, breaker in self._breakers.items()}
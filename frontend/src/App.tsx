@@ -14,6 +14,7 @@ function App() {
   const [voiceSettings, setVoiceSettings] = useState<VoiceSettings>(defaultSettings);
   const [showSettings, setShowSettings] = useState(false);
   const [currentResponse, setCurrentResponse] = useState('');
+  const [sessionId, setSessionId] = useState<string | null>(null);
 
   const handleTranscript = async (text: string) => {
     setIsProcessing(true);
@@ -23,7 +24,7 @@ function App() {
         headers: {
           'Content-Type': 'application/json',
         },
-        body: JSON.stringify({ text }),
+        body: JSON.stringify({ text, session_id: sessionId }),
       });
 
       if (!response.ok) {
@@ -31,6 +32,7 @@ function App() {
       }
 
       const data = await response.json();
+      setSessionId(data.session_id);
       setCurrentResponse(data.response);
     } catch (error) {
       console.error('Error:', error);